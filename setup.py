@@ -7,7 +7,6 @@ setup(
     include_package_data=True,
     install_requires=[
         'argon2-cffi==23.1.0',
-        'beautifulsoup4==4.12.3',
         'elasticsearch==7.17.12',
         'flask==3.1.0',
         'flask-jwt-extended==4.7.1',
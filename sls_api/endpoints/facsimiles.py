@@ -1,5 +1,4 @@
-from flask import Blueprint, jsonify, request, Response
-import io
+from flask import Blueprint, jsonify, request, Response, send_file
 import logging
 import os
 import sqlalchemy
@@ -280,13 +279,9 @@ def get_facsimile_file(project, collection_id, number, zoom_level):
                                   "{}.jpg".format(int(number)))
         connection.close()
 
-        output = io.BytesIO()
         try:
-            with open(file_path, mode="rb") as img_file:
-                output.write(img_file.read())
-            content = output.getvalue()
-            output.close()
-            return Response(content, status=200, content_type="image/jpeg")
+            # send the file as it is, without reading it into memory and copying it first
+            return send_file(file_path, mimetype="image/jpeg")
         except Exception:
             logger.exception(f"Exception reading facsimile at {file_path}")
             return jsonify({
@@ -347,13 +342,9 @@ def get_facsimile_page_image(project, facsimile_type, facs_id, facs_nr):
             # TODO placeholder page image file?
             file_path = ""
 
-        output = io.BytesIO()
         try:
-            with open(file_path, mode="rb") as img_file:
-                output.write(img_file.read())
-            content = output.getvalue()
-            output.close()
-            return Response(content, status=200, content_type="image/jpeg")
+            # send the file as it is, without reading it into memory and copying it first
+            return send_file(file_path, mimetype="image/jpeg")
         except Exception:
             logger.exception(f"Failed to read facsimile page from {file_path}")
             return Response("File not found: " + file_path, status=404, content_type="text/json")
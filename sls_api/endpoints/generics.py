@@ -4,23 +4,31 @@ from datetime import datetime
 from flask import jsonify, Response
 from flask_jwt_extended import get_jwt, get_jwt_identity, verify_jwt_in_request
 from functools import wraps
-import glob
 import hashlib
 import io
+import itertools
 import logging
 from lxml import etree
+import mmap
 import os
 import re
 from ruamel.yaml import YAML
 from sls_api.models import User
 from sqlalchemy import create_engine, Connection, MetaData, Table
 from sqlalchemy.sql import select, text
+import threading
 import time
 from typing import Any, Dict, List, Optional, Tuple
 from werkzeug.security import safe_join
 
 ALLOWED_EXTENSIONS_FOR_FACSIMILE_UPLOAD = ["tif", "tiff", "png", "jpg", "jpeg"]
 
+# files at least this large (in bytes) are memory-mapped instead of read in chunks when calculating checksums
+CHECKSUM_MMAP_MIN_SIZE = 1024 * 1024
+# hashlib algorithm used for file checksums, which are only used to tell whether files have changed
+# checksums stored by the publisher are discarded when this changes, as they can't be compared to new ones
+CHECKSUM_ALGORITHM = "sha1"
+
 # temporary folder uploaded facsimiles are stored in before being resized and stored properly in the project files
 FACSIMILE_UPLOAD_FOLDER = "/tmp/uploads"
 
@@ -35,6 +43,12 @@ FACSIMILE_IMAGE_SIZES = {
 
 metadata = MetaData()
 
+# compiled XSLT stylesheets, kept per thread as lxml XSLT objects shouldn't be shared between threads
+xsl_transform_cache = threading.local()
+# the last XML document parsed for a transformation in each thread, so that transforming the same file
+# with several stylesheets in a row only parses it once
+xml_document_cache = threading.local()
+
 logger = logging.getLogger("sls_api.generics")
 
 config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configs")
@@ -82,15 +96,16 @@ def int_or_none(var):
 
 def calculate_checksum(full_file_path) -> str:
     """
-    Read 'full_file_path' in chunks and generate an MD5 checksum for the file, returning as string
+    Read 'full_file_path' in chunks and generate a CHECKSUM_ALGORITHM checksum for the file, returning as string
+    Large files are memory-mapped and hashed in one call instead
     """
-    hash_md5 = hashlib.md5()
     with open(full_file_path, "rb") as f:
-        logger.debug(f"Calculating MD5 checksum for {full_file_path}...")
+        logger.debug(f"Calculating {CHECKSUM_ALGORITHM} checksum for {full_file_path}...")
+        if os.fstat(f.fileno()).st_size >= CHECKSUM_MMAP_MIN_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                return hashlib.new(CHECKSUM_ALGORITHM, mapped_file).hexdigest()
         # read in chunks to prevent having to load entire file into memory at once
-        for chunk in iter(lambda: f.read(8 * hash_md5.block_size), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        return hashlib.file_digest(f, CHECKSUM_ALGORITHM).hexdigest()
 
 
 def project_permission_required(fn):
@@ -156,12 +171,24 @@ def get_project_id_from_name(project):
         return None
 
 
-def get_collection_legacy_id(collection_id):
-    publication_collection = Table('publication_collection', metadata, autoload_with=db_engine)
-    connection = db_engine.connect()
-    statement = select(publication_collection.c.legacy_id).where(publication_collection.c.id == collection_id)
-    collection_legacy_id = connection.execute(statement).fetchone()
-    connection.close()
+COLLECTION_LEGACY_ID_STATEMENT = text("SELECT legacy_id FROM publication_collection WHERE id = :c_id")
+
+
+def get_collection_legacy_id(collection_id, connection=None):
+    """
+    Returns the legacy_id of the given publication_collection as an int, or None if it isn't set.
+
+    If a connection is provided, it is used (and left open), otherwise a new
+    connection is created and closed once the query is done.
+    """
+    if connection is None:
+        connection = db_engine.connect()
+        new_connection = True
+    else:
+        new_connection = False
+    collection_legacy_id = connection.execute(COLLECTION_LEGACY_ID_STATEMENT, {"c_id": collection_id}).fetchone()
+    if new_connection:
+        connection.close()
     try:
         return int(collection_legacy_id.legacy_id)
     except Exception:
@@ -205,14 +232,38 @@ def slugify_path(project, path):
     return re.sub('.md', '', path)
 
 
-def path_hierarchy(project, path, language):
+def list_directory_entries(path):
+    """
+    Returns the entries in the given directory, sorted by path and leaving out hidden entries, like glob.glob(path/*) would
+    Returns an empty list if path isn't a directory
+    """
+    try:
+        with os.scandir(path) as entries:
+            return sorted((entry for entry in entries if not entry.name.startswith('.')), key=lambda entry: entry.path)
+    except OSError:
+        return []
+
+
+def path_hierarchy(project, path, language, is_dir=True):
     project_config = get_project_config(project)
-    hierarchy = {'id': slugify_id(path, language), 'title': filter_title(os.path.basename(path)),
-                 'basename': re.sub('.md', '', os.path.basename(path)), 'path': slugify_path(project, path),
+    return _path_hierarchy(path, language, "/" + project_config["file_root"] + "/md/", is_dir)
+
+
+def _path_hierarchy(path, language, md_root, is_dir):
+    # directories are listed with os.scandir, its entries tell which children are directories so files aren't listed at all
+    if is_dir:
+        children = [_path_hierarchy(entry.path, language, md_root, entry.is_dir()) for entry in list_directory_entries(path)]
+    else:
+        children = []
+    # the path below the md folder is both the page path (like slugify_path) and the base of the route
+    md_path = split_after(path, md_root)
+    basename = os.path.basename(path)
+    hierarchy = {'id': slugify_id(path, language), 'title': filter_title(basename),
+                 'basename': re.sub('.md', '', basename), 'path': re.sub('.md', '', md_path),
                  'fullpath': path,
-                 'route': slugify_route(split_after(path, "/" + project_config["file_root"] + "/md/")),
+                 'route': slugify_route(md_path),
                  'type': 'folder',
-                 'children': [path_hierarchy(project, p, language) for p in sorted(glob.glob(os.path.join(path, '*')))]}
+                 'children': children}
 
     if not hierarchy['children']:
         del hierarchy['children']
@@ -237,25 +288,42 @@ def split_after(value, a):
     return value[adjusted_pos_a:]
 
 
-def cache_is_recent(source_file, xsl_file, cache_file):
+def cache_is_recent(source_file, xsl_file, cache_file, cache_file_mtime=None):
     """
     Returns False if the source or xsl file have been modified since the creation of the cache file
     Returns False if the cache is more than 'cache_lifetime_seconds' seconds old, as defined in config file
     Otherwise, returns True
+    The modification time of the cache file can be given if the caller already has it.
+    Files are only stat'ed as long as the cache still looks recent.
     """
     try:
-        source_file_mtime = os.path.getmtime(source_file)
-        xsl_file_mtime = os.path.getmtime(xsl_file)
-        cache_file_mtime = os.path.getmtime(cache_file)
+        if cache_file_mtime is None:
+            cache_file_mtime = os.path.getmtime(cache_file)
+        if calendar.timegm(time.gmtime()) > (cache_file_mtime + config["cache_lifetime_seconds"]):
+            return False
+        if os.path.getmtime(source_file) > cache_file_mtime or os.path.getmtime(xsl_file) > cache_file_mtime:
+            return False
     except OSError:
         return False
-    if source_file_mtime > cache_file_mtime or xsl_file_mtime > cache_file_mtime:
-        return False
-    elif calendar.timegm(time.gmtime()) > (cache_file_mtime + config["cache_lifetime_seconds"]):
-        return False
     return True
 
 
+PUBLISHED_STATUS_STATEMENT = text("""SELECT project.published AS proj_pub, publication_collection.published AS col_pub, publication.published as pub
+    FROM project
+    JOIN publication_collection ON publication_collection.project_id = project.id
+    JOIN publication ON publication.publication_collection_id = publication_collection.id
+    WHERE project.id = publication_collection.project_id
+    AND publication.publication_collection_id = publication_collection.id
+    AND project.name = :project AND publication_collection.id = :c_id AND (publication.id = :p_id OR split_part(publication.legacy_id, '_', 2) = :str_p_id)
+    """)
+
+COLLECTION_PUBLISHED_STATUS_STATEMENT = text("""SELECT project.published AS proj_pub, publication_collection.published AS col_pub
+    FROM project
+    JOIN publication_collection ON publication_collection.project_id = project.id
+    AND project.id = :project_id AND publication_collection.id = :c_id
+    """)
+
+
 def get_published_status(project, collection_id, publication_id):
     """
     Returns info on if project, publication_collection, and publication are all published
@@ -274,16 +342,8 @@ def get_published_status(project, collection_id, publication_id):
         return False, "No such publication_id."
 
     connection = db_engine.connect()
-    stmt = """SELECT project.published AS proj_pub, publication_collection.published AS col_pub, publication.published as pub
-    FROM project
-    JOIN publication_collection ON publication_collection.project_id = project.id
-    JOIN publication ON publication.publication_collection_id = publication_collection.id
-    WHERE project.id = publication_collection.project_id
-    AND publication.publication_collection_id = publication_collection.id
-    AND project.name = :project AND publication_collection.id = :c_id AND (publication.id = :p_id OR split_part(publication.legacy_id, '_', 2) = :str_p_id)
-    """
-    statement = text(stmt).bindparams(project=project, c_id=collection_id, p_id=publication_id, str_p_id=str(publication_id))
-    result = connection.execute(statement)
+    result = connection.execute(PUBLISHED_STATUS_STATEMENT,
+                                {"project": project, "c_id": collection_id, "p_id": publication_id, "str_p_id": str(publication_id)})
     show_internal = project_config["show_internally_published"]
     can_show = False
     message = ""
@@ -322,13 +382,7 @@ def get_collection_published_status(project, collection_id):
 
     project_id = get_project_id_from_name(project)
 
-    stmt = """SELECT project.published AS proj_pub, publication_collection.published AS col_pub
-    FROM project
-    JOIN publication_collection ON publication_collection.project_id = project.id
-    AND project.id = :project_id AND publication_collection.id = :c_id
-    """
-    statement = text(stmt).bindparams(project_id=project_id, c_id=collection_id)
-    result = connection.execute(statement)
+    result = connection.execute(COLLECTION_PUBLISHED_STATUS_STATEMENT, {"project_id": project_id, "c_id": collection_id})
     show_internal = project_config["show_internally_published"]
     can_show = False
     message = ""
@@ -348,33 +402,107 @@ def get_collection_published_status(project, collection_id):
 
 
 class FileResolver(etree.Resolver):
+    def __init__(self, resolved_files=None):
+        super().__init__()
+        # if a list is given, the path of every resolved file is appended to it
+        self.resolved_files = resolved_files
+
     def resolve(self, system_url, public_id, context):
         logger.debug("Resolving {}".format(system_url))
+        if self.resolved_files is not None:
+            self.resolved_files.append(system_url)
         return self.resolve_filename(system_url, context)
 
 
-def transform_xml(xsl_file_path, xml_file_path, replace_namespace=False, params=None):
+def get_file_signature(file_path):
+    """
+    Returns a (modification time, size) tuple for the given file, or None if the file can't be accessed
+    """
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+def get_xsl_transform(xsl_file_path):
+    """
+    Returns a compiled XSLT transform for the given stylesheet
+    The stylesheet is only parsed and compiled again if it, or a stylesheet it includes or imports, has changed since the last call
+    """
+    if not hasattr(xsl_transform_cache, "transforms"):
+        xsl_transform_cache.transforms = dict()
+    cached = xsl_transform_cache.transforms.get(xsl_file_path)
+    if cached is not None:
+        dependencies, xsl_transform = cached
+        if all(get_file_signature(path) == signature for path, signature in dependencies.items()):
+            return xsl_transform
+
+    # take the signature before parsing, so a change made while compiling is noticed on the next call
+    signature = get_file_signature(xsl_file_path)
+    # the resolver records the stylesheets included or imported while compiling, so they don't have to be parsed again to find them
+    resolved_files = []
+    file_resolver = FileResolver(resolved_files)
+    xsl_parser = etree.XMLParser()
+    xsl_parser.resolvers.add(file_resolver)
+    with io.open(xsl_file_path, encoding="UTF-8") as xsl_file:
+        xslt_root = etree.parse(xsl_file, parser=xsl_parser)
+        xsl_transform = etree.XSLT(xslt_root)
+    # the resolver stays in use for document() calls while transforming, stop recording once compiling is done
+    # so the list doesn't keep growing for as long as the compiled stylesheet is cached
+    file_resolver.resolved_files = None
+    dependencies = {path: get_file_signature(path) for path in resolved_files if "://" not in path}
+    dependencies[xsl_file_path] = signature
+    xsl_transform_cache.transforms[xsl_file_path] = (dependencies, xsl_transform)
+    return xsl_transform
+
+
+def get_xml_document(xml_file_path):
+    """
+    Returns the root element of the parsed XML file, raising FileNotFoundError if the file doesn't exist
+    The last document parsed in this thread is reused if the file hasn't changed since, as the same file is often
+    transformed with several stylesheets in a row (e.g. the changes and normalized views of a manuscript)
+    """
+    signature = get_file_signature(xml_file_path)
+    if signature is None:
+        raise FileNotFoundError(xml_file_path)
+    cached = getattr(xml_document_cache, "document", None)
+    if cached is not None and cached[0] == xml_file_path and cached[1] == signature:
+        return cached[2]
+    # drop the previous document before parsing the next one, so two documents aren't held in memory at once
+    xml_document_cache.document = None
+    with io.open(xml_file_path, mode="rb") as xml_file:
+        # parse straight from the file, so large files aren't held in memory both as bytes and as a tree
+        xml_root = etree.parse(xml_file).getroot()
+    xml_document_cache.document = (xml_file_path, signature, xml_root)
+    return xml_root
+
+
+def transform_xml(xsl_file_path, xml_file_path, replace_namespace=False, params=None, replace_ids=False):
+    """
+    Transforms the XML file with the XSL stylesheet and returns the result as a string
+    If replace_ids is True, id attributes in the result are renamed to data-id before it's serialized
+    """
     logger.debug("Transforming {} using {}".format(xml_file_path, xsl_file_path))
     if params is not None:
         logger.debug("Parameters are {}".format(params))
-    if not os.path.exists(xsl_file_path):
+    # the compiled stylesheet is reused between calls, looking it up already checks that the stylesheet file is there
+    try:
+        xsl_transform = get_xsl_transform(xsl_file_path)
+    except FileNotFoundError:
         return "XSL file {!r} not found!".format(xsl_file_path)
-    if not os.path.exists(xml_file_path):
-        return "XML file {!r} not found!".format(xml_file_path)
 
-    with io.open(xml_file_path, mode="rb") as xml_file:
-        xml_contents = xml_file.read()
+    try:
         if replace_namespace:
+            with io.open(xml_file_path, mode="rb") as xml_file:
+                xml_contents = xml_file.read()
             xml_contents = xml_contents.replace(b'xmlns="http://www.sls.fi/tei"',
                                                 b'xmlns="http://www.tei-c.org/ns/1.0"')
-
-        xml_root = etree.fromstring(xml_contents)
-
-    xsl_parser = etree.XMLParser()
-    xsl_parser.resolvers.add(FileResolver())
-    with io.open(xsl_file_path, encoding="UTF-8") as xsl_file:
-        xslt_root = etree.parse(xsl_file, parser=xsl_parser)
-        xsl_transform = etree.XSLT(xslt_root)
+            xml_root = etree.fromstring(xml_contents)
+        else:
+            xml_root = get_xml_document(xml_file_path)
+    except FileNotFoundError:
+        return "XML file {!r} not found!".format(xml_file_path)
 
     if params is None:
         result = xsl_transform(xml_root)
@@ -386,23 +514,39 @@ def transform_xml(xsl_file_path, xml_file_path, replace_namespace=False, params=
                 type(params)))
     if len(xsl_transform.error_log) > 0:
         logging.debug(xsl_transform.error_log)
+    if replace_ids:
+        result_root = result.getroot()
+        if result_root is None:
+            # text output has no tree to rename attributes in
+            return str(result).replace(" id=", " data-id=")
+        # the attributes are renamed in the result tree, so only actual id attributes are affected, not text that happens to contain " id="
+        # a result can be a fragment with several top level elements, getroot() only returns the first of them
+        for top_level_element in itertools.chain([result_root], result_root.itersiblings(etree.Element)):
+            for element in top_level_element.iter(etree.Element):
+                if "id" in element.attrib:
+                    # the attributes are set again rather than popping id, so they stay in their original order
+                    attributes = [("data-id" if name == "id" else name, value) for name, value in element.attrib.items()]
+                    element.attrib.clear()
+                    element.attrib.update(attributes)
     return str(result)
 
 
-def get_content(project, folder, xml_filename, xsl_filename, parameters):
+def get_content(project, folder, xml_filename, xsl_filename, parameters, replace_ids=False):
     project_config = get_project_config(project)
     if project_config is None:
         return "No such project."
     xml_file_path = safe_join(project_config["file_root"], "xml", folder, xml_filename)
     xsl_file_path = safe_join(project_config["file_root"], "xslt", xsl_filename)
     cache_folder = os.path.join("/tmp", "api_cache", project, folder)
-    os.makedirs(cache_folder, exist_ok=True)
     if "ms" in xsl_filename:
         # xsl_filename is 'ms_changes.xsl' or 'ms_normalized.xsl'
         # ensure that '_changes' or '_normalized' is appended to the cache filename accordingly
         cache_extension = "{}.html".format(xsl_filename.split("ms")[1].replace(".xsl", ""))
     else:
         cache_extension = ".html"
+    if replace_ids:
+        # content with id attributes renamed to data-id is cached separately from the plain transformation result
+        cache_extension = "_data-id{}".format(cache_extension)
     cache_file_path = os.path.join(cache_folder, xml_filename.replace(".xml", cache_extension))
 
     content = None
@@ -419,8 +563,13 @@ def get_content(project, folder, xml_filename, xsl_filename, parameters):
 
     logger.debug("Cache file path for {} is {}".format(xml_filename, cache_file_path))
 
-    if os.path.exists(cache_file_path):
-        if cache_is_recent(xml_file_path, xsl_file_path, cache_file_path):
+    # the modification time of the cache file also tells whether it exists, so it's only stat'ed once
+    try:
+        cache_file_mtime = os.path.getmtime(cache_file_path)
+    except OSError:
+        cache_file_mtime = None
+    if cache_file_mtime is not None:
+        if cache_is_recent(xml_file_path, xsl_file_path, cache_file_path, cache_file_mtime=cache_file_mtime):
             try:
                 with io.open(cache_file_path, encoding="UTF-8") as cache_file:
                     content = cache_file.read()
@@ -432,11 +581,14 @@ def get_content(project, folder, xml_filename, xsl_filename, parameters):
         else:
             logger.info("Cache file is old or invalid, deleting cache file...")
             os.remove(cache_file_path)
-    if os.path.exists(xml_file_path) and content is None:
+    if content is None and os.path.exists(xml_file_path):
         logger.info("Getting contents from file and transforming...")
         try:
-            content = transform_xml(xsl_file_path, xml_file_path, params=parameters).replace('\n', '').replace('\r', '')
+            # id attributes are renamed before caching, so it's done once per transformation instead of on every request
+            content = transform_xml(xsl_file_path, xml_file_path, params=parameters, replace_ids=replace_ids).replace('\n', '').replace('\r', '')
             try:
+                # the cache folder is only needed when writing, cache hits don't have to check for it
+                os.makedirs(cache_folder, exist_ok=True)
                 with io.open(cache_file_path, mode="w", encoding="UTF-8") as cache_file:
                     cache_file.write(content)
             except Exception:
@@ -311,12 +311,8 @@ def get_gallery_image(project, collection_id, file_name):
             return Response("Couldn't get gallery file.", status=404, content_type="text/json")
         file_path = safe_join(config["file_root"], "media", str(result['image_path']), "{}".format(str(file_name)))
         try:
-            output = io.BytesIO()
-            with open(file_path, mode="rb") as img_file:
-                output.write(img_file.read())
-            content = output.getvalue()
-            output.close()
-            return Response(content, status=200, content_type="image/jpeg")
+            # send the file as it is, without reading it into memory and copying it first
+            return send_file(file_path, mimetype="image/jpeg")
         except Exception:
             logger.exception(f"Failed to read from image file at {file_path}")
             return Response("File not found: " + file_path, status=404, content_type="text/json")
@@ -354,12 +350,8 @@ def get_type_gallery_image(project, connection_type, connection_id):
         file_path = safe_join(config["file_root"], "media", str(result['image_path']),
                               str(result['image_filename_front']).replace(".jpg", "_thumb.jpg"))
         try:
-            output = io.BytesIO()
-            with open(file_path, mode="rb") as img_file:
-                output.write(img_file.read())
-            content = output.getvalue()
-            output.close()
-            return Response(content, status=200, content_type="image/jpeg")
+            # send the file as it is, without reading it into memory and copying it first
+            return send_file(file_path, mimetype="image/jpeg")
         except Exception:
             logger.exception(f"Failed to read from image file at {file_path}")
             return Response("File not found: " + file_path, status=404, content_type="text/json")
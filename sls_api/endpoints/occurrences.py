@@ -128,10 +128,9 @@ def get_all_occurrences_by_type(object_type, project=None):
                     type_stmnt = sqlalchemy.sql.text(
                         "SELECT type, subject.first_name::text, subject.last_name::text, subject.source::text, subject.description::text, subject.occupation::text, subject.place_of_birth::text, subject.date_born::text, subject.date_deceased::text FROM subject WHERE id=:ty_id").bindparams(
                         ty_id=object_id)
-                    type_object = connection.execute(type_stmnt).fetchone()
+                    type_object = connection.execute(type_stmnt).mappings().fetchone()
                     if type_object is None:
                         continue
-                    type_object = type_object._asdict()
                     row["object_type"] = type_object["type"]
                     row["date_born"] = type_object["date_born"]
                     row["date_deceased"] = type_object["date_deceased"]
@@ -145,10 +144,9 @@ def get_all_occurrences_by_type(object_type, project=None):
                     type_stmnt = sqlalchemy.sql.text(
                         "SELECT tag.type::text, tag.description::text, tag.source::text, tag.name::text FROM tag WHERE id=:ty_id").bindparams(
                         ty_id=object_id)
-                    type_object = connection.execute(type_stmnt).fetchone()
+                    type_object = connection.execute(type_stmnt).mappings().fetchone()
                     if type_object is None:
                         continue
-                    type_object = type_object._asdict()
                     row["description"] = type_object["description"]
                     row["source"] = type_object["source"]
                     row["name"] = type_object["name"]
@@ -159,10 +157,9 @@ def get_all_occurrences_by_type(object_type, project=None):
                         publication_location::text, translated_by::text, work_id::text, work_manuscript_id::text, linked_work_manifestation_id::text
                         FROM work_manifestation WHERE id=:ty_id""").bindparams(
                         ty_id=object_id)
-                    type_object = connection.execute(type_stmnt).fetchone()
+                    type_object = connection.execute(type_stmnt).mappings().fetchone()
                     if type_object is None:
                         continue
-                    type_object = type_object._asdict()
                     row["description"] = type_object["description"]
                     row["source"] = type_object["source"]
                     row["name"] = type_object["title"]
@@ -182,10 +179,9 @@ def get_all_occurrences_by_type(object_type, project=None):
                     type_stmnt = sqlalchemy.sql.text("SELECT location.description::text, location.source::text, location.name::text, location.country::text, location.city::text, \
                                                         location.latitude::text, location.longitude::text, location.region::text FROM location WHERE id=:ty_id").bindparams(
                         ty_id=object_id)
-                    type_object = connection.execute(type_stmnt).fetchone()
+                    type_object = connection.execute(type_stmnt).mappings().fetchone()
                     if type_object is None:
                         continue
-                    type_object = type_object._asdict()
                     row["description"] = type_object["description"]
                     row["source"] = type_object["source"]
                     row["name"] = type_object["name"]
@@ -331,9 +327,8 @@ def get_subject_occurrences(project=None, subject_id=None):
                 ORDER BY ps.type ASC"
                 song_sql = sqlalchemy.sql.text(song_sql).bindparams(song_id=occurrenceData['publication_song_id'])
                 song_result = connection_2.execute(song_sql)
-                song_data = song_result.fetchone()
+                song_data = song_result.mappings().fetchone()
                 if song_data is not None:
-                    song_data = song_data._asdict()
                     occurrenceData.update(song_data)
             subject['occurrences'].append(occurrenceData)
             occurrence = result_2.fetchone()
@@ -409,9 +404,8 @@ def get_location_occurrences(project=None, location_id=None):
                 ORDER BY ps.type ASC"
                 song_sql = sqlalchemy.sql.text(song_sql).bindparams(song_id=occurrenceData['publication_song_id'])
                 song_result = connection_2.execute(song_sql)
-                song_data = song_result.fetchone()
+                song_data = song_result.mappings().fetchone()
                 if song_data is not None:
-                    song_data = song_data._asdict()
                     occurrenceData.update(song_data)
             location['occurrences'].append(occurrenceData)
             occurrence = result_2.fetchone()
@@ -487,9 +481,8 @@ def get_tag_occurrences(project=None, tag_id=None):
                 ORDER BY ps.type ASC"
                 song_sql = sqlalchemy.sql.text(song_sql).bindparams(song_id=occurrenceData['publication_song_id'])
                 song_result = connection_2.execute(song_sql)
-                song_data = song_result.fetchone()
+                song_data = song_result.mappings().fetchone()
                 if song_data is not None:
-                    song_data = song_data._asdict()
                     occurrenceData.update(song_data)
             tag['occurrences'].append(occurrenceData)
             occurrence = result_2.fetchone()
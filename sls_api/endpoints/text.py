@@ -54,10 +54,10 @@ def get_introduction(project, collection_id, publication_id, lang="swe"):
             # TODO get original_filename from publication_collection_introduction table? how handle language/version
             filename = "{}_inl_{}_{}.xml".format(collection_id, lang, version)
             xsl_file = "introduction.xsl"
-            content = get_content(project, "inl", filename, xsl_file, None)
+            content = get_content(project, "inl", filename, xsl_file, None, replace_ids=True)
             data = {
                 "id": "{}_{}_inl".format(collection_id, publication_id),
-                "content": content.replace(" id=", " data-id=")
+                "content": content
             }
             return jsonify(data), 200
         else:
@@ -84,10 +84,10 @@ def get_title(project, collection_id, publication_id, lang="swe"):
             # TODO get original_filename from publication_collection_title table? how handle language/version
             filename = "{}_tit_{}_{}.xml".format(collection_id, lang, version)
             xsl_file = "title.xsl"
-            content = get_content(project, "tit", filename, xsl_file, None)
+            content = get_content(project, "tit", filename, xsl_file, None, replace_ids=True)
             data = {
                 "id": "{}_{}_tit".format(collection_id, publication_id),
-                "content": content.replace(" id=", " data-id=")
+                "content": content
             }
             return jsonify(data), 200
         else:
@@ -114,10 +114,10 @@ def get_foreword(project, collection_id, lang="sv"):
             # TODO get original_filename from database table? how handle language/version
             filename = "{}_fore_{}_{}.xml".format(collection_id, lang, version)
             xsl_file = "foreword.xsl"
-            content = get_content(project, "fore", filename, xsl_file, None)
+            content = get_content(project, "fore", filename, xsl_file, None, replace_ids=True)
             data = {
                 "id": "{}_fore".format(collection_id),
-                "content": content.replace(" id=", " data-id=")
+                "content": content
             }
             return jsonify(data), 200
         else:
@@ -151,7 +151,7 @@ def get_reading_text(project, collection_id, publication_id, section_id=None, la
         logger.debug("Filename (est) for {} is {}".format(publication_id, filename))
         xsl_file = "est.xsl"
 
-        bookId = get_collection_legacy_id(collection_id)
+        bookId = get_collection_legacy_id(collection_id, connection=connection)
         if bookId is None:
             bookId = collection_id
         bookId = '"{}"'.format(bookId)
@@ -159,9 +159,9 @@ def get_reading_text(project, collection_id, publication_id, section_id=None, la
         if section_id is not None:
             section_id = '"{}"'.format(section_id)
             content = get_content(project, "est", filename, xsl_file,
-                                  {"bookId": bookId, "sectionId": section_id})
+                                  {"bookId": bookId, "sectionId": section_id}, replace_ids=True)
         else:
-            content = get_content(project, "est", filename, xsl_file, {"bookId": bookId})
+            content = get_content(project, "est", filename, xsl_file, {"bookId": bookId}, replace_ids=True)
 
         select = "SELECT language FROM publication WHERE id = :p_id"
         statement = sqlalchemy.sql.text(select).bindparams(p_id=publication_id)
@@ -173,7 +173,7 @@ def get_reading_text(project, collection_id, publication_id, section_id=None, la
 
         data = {
             "id": "{}_{}_est".format(collection_id, publication_id),
-            "content": content.replace(" id=", " data-id="),
+            "content": content,
             "language": text_language
         }
         connection.close()
@@ -206,7 +206,7 @@ def get_comments(project, collection_id, publication_id, note_id=None, section_i
             statement = sqlalchemy.sql.text(select).bindparams(p_id=publication_id)
             result = connection.execute(statement).fetchone()
 
-            bookId = get_collection_legacy_id(collection_id)
+            bookId = get_collection_legacy_id(collection_id, connection=connection)
             if bookId is None:
                 bookId = collection_id
 
@@ -310,7 +310,6 @@ def get_manuscript(project, collection_id, publication_id, manuscript_id=None, s
             for row in connection.execute(statement).fetchall():
                 if row is not None:
                     manuscript_info.append(row._asdict())
-            connection.close()
         else:
             select = "SELECT sort_order, name, legacy_id, id, original_filename, language FROM publication_manuscript WHERE publication_id = :p_id AND deleted != 1 ORDER BY sort_order ASC"
             statement = sqlalchemy.sql.text(select).bindparams(p_id=publication_id)
@@ -318,38 +317,41 @@ def get_manuscript(project, collection_id, publication_id, manuscript_id=None, s
             for row in connection.execute(statement).fetchall():
                 if row is not None:
                     manuscript_info.append(row._asdict())
-            connection.close()
 
-        bookId = get_collection_legacy_id(collection_id)
+        # look up the collection legacy_id on the same connection, instead of opening another one
+        bookId = get_collection_legacy_id(collection_id, connection=connection)
+        connection.close()
         if bookId is None:
             bookId = collection_id
 
         bookId = '"{}"'.format(bookId)
 
+        # the parameters are the same for all manuscripts, so they're only built once
+        if section_id is not None:
+            section_id = '"{}"'.format(section_id)
+            params = {
+                "bookId": bookId,
+                "sectionId": str(section_id)
+            }
+        elif manuscript_id is not None and 'ch' in str(manuscript_id):
+            section_id = '"{}"'.format(manuscript_id)
+            params = {
+                "bookId": bookId,
+                "sectionId": str(section_id)
+            }
+        else:
+            params = {
+                "bookId": bookId
+            }
+
         for index in range(len(manuscript_info)):
             manuscript = manuscript_info[index]
-            if section_id is not None:
-                section_id = '"{}"'.format(section_id)
-                params = {
-                    "bookId": bookId,
-                    "sectionId": str(section_id)
-                }
-            elif manuscript_id is not None and 'ch' in str(manuscript_id):
-                section_id = '"{}"'.format(manuscript_id)
-                params = {
-                    "bookId": bookId,
-                    "sectionId": str(section_id)
-                }
-            else:
-                params = {
-                    "bookId": bookId
-                }
             if manuscript["original_filename"] is None and manuscript["legacy_id"] is not None:
                 filename = "{}.xml".format(manuscript["legacy_id"])
             else:
                 filename = "{}_{}_ms_{}.xml".format(collection_id, publication_id, manuscript["id"])
-            manuscript_info[index]["manuscript_changes"] = get_content(project, "ms", filename, "ms_changes.xsl", params).replace(" id=", " data-id=")
-            manuscript_info[index]["manuscript_normalized"] = get_content(project, "ms", filename, "ms_normalized.xsl", params).replace(" id=", " data-id=")
+            manuscript_info[index]["manuscript_changes"] = get_content(project, "ms", filename, "ms_changes.xsl", params, replace_ids=True)
+            manuscript_info[index]["manuscript_normalized"] = get_content(project, "ms", filename, "ms_normalized.xsl", params, replace_ids=True)
 
         data = {
             "id": "{}_{}".format(collection_id, publication_id),
@@ -379,9 +381,10 @@ def get_variant(project, collection_id, publication_id, section_id=None):
         for row in connection.execute(statement).fetchall():
             if row is not None:
                 variation_info.append(row._asdict())
-        connection.close()
 
-        bookId = get_collection_legacy_id(collection_id)
+        # look up the collection legacy_id on the same connection, instead of opening another one
+        bookId = get_collection_legacy_id(collection_id, connection=connection)
+        connection.close()
         if bookId is None:
             bookId = collection_id
 
@@ -490,7 +493,7 @@ def get_reading_text_downloadable_format(project, format, collection_id, publica
         else:
             xsl_file = None
 
-        bookId = get_collection_legacy_id(collection_id)
+        bookId = get_collection_legacy_id(collection_id, connection=connection)
         if bookId is None:
             bookId = collection_id
         bookId = '"{}"'.format(bookId)
@@ -546,7 +549,7 @@ def get_comments_downloadable_format(project, format, collection_id, publication
             statement = sqlalchemy.sql.text(select).bindparams(p_id=publication_id)
             result = connection.execute(statement).fetchone()
 
-            bookId = get_collection_legacy_id(collection_id)
+            bookId = get_collection_legacy_id(collection_id, connection=connection)
             if bookId is None:
                 bookId = collection_id
             bookId = '"{}"'.format(bookId)
@@ -18,6 +18,11 @@ from sls_api.endpoints.generics import get_project_config, \
 file_tools = Blueprint("file_tools", __name__)
 logger = logging.getLogger("sls_api.tools.files")
 
+# TEI namespace and the qualified tags used when extracting metadata from TEI XML files
+TEI_NAMESPACES = {"tei": "http://www.tei-c.org/ns/1.0"}
+TEI_HEADER_TAG = "{http://www.tei-c.org/ns/1.0}teiHeader"
+TEI_TEXT_TAG = "{http://www.tei-c.org/ns/1.0}text"
+
 
 def check_project_config(project):
     """
@@ -409,7 +414,7 @@ def update_file(project, file_path):
     )
 
     # Read the file from request and decode the base64 string into raw binary data
-    file = io.BytesIO(base64.b64decode(request_data["file"]))
+    file_content = base64.b64decode(request_data["file"])
 
     # verify git config
     config_okay = check_project_config(project)
@@ -465,9 +470,9 @@ def update_file(project, file_path):
     pos = file_path.find('.xml')
     if pos > 0:
         filename = safe_join(config["file_root"], file_path)
-        if file and filename:
+        if filename:
             with io.open(filename, mode="wb") as new_file:
-                new_file.write(file.getvalue())
+                new_file.write(file_content)
     else:
         return jsonify({
                 "msg": "File path error"
@@ -815,28 +820,44 @@ def extract_publication_metadata_from_tei_xml(file_path: str) -> Tuple[Optional[
         >>> metadata, error_message, status_code = extract_publication_metadata_from_tei_xml('/path/to/file.xml')
     """
     try:
-        # Parse the XML file and extract relevant metadata from it
+        # Parse the XML file only as far as needed: all the metadata is in
+        # <teiHeader> and the start tag of <text>, so stop reading once both
+        # have been seen instead of building a tree of the whole text
+        header_element = None
+        text_element = None
+        depth = 0
         with open(file_path, "r", encoding="utf-8-sig") as xml_file:
-            tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Determine namespace
-        ns = {'tei': 'http://www.tei-c.org/ns/1.0'}
+            for event, element in ET.iterparse(xml_file, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    # Children of the root element are at depth 2
+                    if depth == 2 and element.tag == TEI_TEXT_TAG and text_element is None:
+                        text_element = element
+                else:
+                    if depth == 2 and element.tag == TEI_HEADER_TAG and header_element is None:
+                        header_element = element
+                    depth -= 1
+                if header_element is not None and text_element is not None:
+                    break
 
         # Helper function to get full text including subelements
         def get_full_text(element):
             return "".join(element.itertext()) if element is not None else None
 
+        # Helper function to find an element within <teiHeader>
+        def find_in_header(path):
+            return header_element.find(path, namespaces=TEI_NAMESPACES) if header_element is not None else None
+
         # Extract the full text of <title> inside <titleStmt>
-        title_element = root.find("./tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:title", namespaces=ns)
+        title_element = find_in_header("./tei:fileDesc/tei:titleStmt/tei:title")
         title = get_full_text(title_element)
 
         # Extract the @when attribute value in <origDate> within <sourceDesc>
-        orig_date_element = root.find("./tei:teiHeader/tei:fileDesc/tei:sourceDesc//tei:origDate", namespaces=ns)
+        orig_date_element = find_in_header("./tei:fileDesc/tei:sourceDesc//tei:origDate")
         orig_date = orig_date_element.get("when") if orig_date_element is not None else None
         if not orig_date:
             # Search for a <date> with @when in <bibl> within <sourceDesc>
-            date_element = root.find("./tei:teiHeader/tei:fileDesc/tei:sourceDesc/tei:bibl//tei:date", namespaces=ns)
+            date_element = find_in_header("./tei:fileDesc/tei:sourceDesc/tei:bibl//tei:date")
             orig_date = date_element.get("when") if date_element is not None else None
 
             # Validate orig_date, must conform to YYYY, YYYY-MM
@@ -848,7 +869,6 @@ def extract_publication_metadata_from_tei_xml(file_path: str) -> Tuple[Optional[
                 orig_date = None
 
         # Extract the @xml:lang attribute in <text>
-        text_element = root.find("./tei:text", namespaces=ns)
         language = (text_element.get("{http://www.w3.org/XML/1998/namespace}lang")
                     if text_element is not None
                     else None)
@@ -881,20 +901,15 @@ def path_list_to_tree(path_list):
     """
     file_tree = {}
     for path in path_list:
-        _recurse(path, file_tree)
+        _add_path(path, file_tree)
     return file_tree
 
 
-def _recurse(path, container):
+def _add_path(path, container):
     """
-    Recurse over path and container to make a nested dict of path in container
+    Add path to container as a nested dict, splitting the path only once
     """
     parts = path.split("/")
-    head = parts[0]
-    tail = parts[1:]
-    if not tail:
-        container[head] = None
-    else:
-        if head not in container:
-            container[head] = {}
-        _recurse("/".join(tail), container[head])
+    for head in parts[:-1]:
+        container = container.setdefault(head, {})
+    container[parts[-1]] = None
@@ -1191,6 +1191,13 @@ def verify_facsimile_file_exists(project, collection_id, file_nr, zoom_level):
             return create_error_response("Error: project config does not exist on server.", 500)
         base_path = safe_join(config["file_root"], "facsimiles")
 
+    # The folder of the zoom level is joined safely once, the file names
+    # within it are built from validated integers only.
+    zoom_level_path = safe_join(base_path, str(collection_id), str(zoom_level))
+    if zoom_level_path is None:
+        logger.error(f"Invalid facsimile folder path for collection with ID {collection_id}.")
+        return create_error_response("Error accessing facsimile files.", 500)
+
     # Create list of file paths where each item is a tuple with the file
     # number as the first part and the path as the second part.
     file_paths = []
@@ -1202,22 +1209,34 @@ def verify_facsimile_file_exists(project, collection_id, file_nr, zoom_level):
 
         for i in range(1, image_count + 1):
             file_paths.append(
-                (i, safe_join(base_path, str(collection_id), str(zoom_level), f"{str(i)}.jpg"))
+                (i, os.path.join(zoom_level_path, f"{i}.jpg"))
             )
     else:
         file_paths.append(
-            (file_nr, safe_join(base_path, str(collection_id), str(zoom_level), f"{file_nr}.jpg"))
+            (file_nr, os.path.join(zoom_level_path, f"{file_nr}.jpg"))
         )
 
     # Check if one or more files exist
     missing_file_numbers = []
-    for file_number, path in file_paths:
+    if len(file_paths) > 1:
+        # List the folder once instead of checking every file separately
         try:
-            if not os.path.isfile(path):
-                missing_file_numbers.append(file_number)
+            with os.scandir(zoom_level_path) as entries:
+                existing_files = {entry.path for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            existing_files = set()
         except Exception:
-            logger.exception(f"Error checking file existence at {path}.")
+            logger.exception(f"Error listing facsimile files in {zoom_level_path}.")
             return create_error_response("Error accessing facsimile files.", 500)
+        missing_file_numbers = [file_number for file_number, path in file_paths if path not in existing_files]
+    else:
+        for file_number, path in file_paths:
+            try:
+                if not os.path.isfile(path):
+                    missing_file_numbers.append(file_number)
+            except Exception:
+                logger.exception(f"Error checking file existence at {path}.")
+                return create_error_response("Error accessing facsimile files.", 500)
 
     if len(file_paths) > 1:
         if len(missing_file_numbers) > 0:
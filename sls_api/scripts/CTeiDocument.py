@@ -1,9 +1,12 @@
 # Imports
 from lxml import etree as ET
+from lxml import html as lxml_html
+import copy
+import functools
 import re
+import threading
 import io
-from io import StringIO
-from bs4 import BeautifulSoup
+import os
 
 # Configuration
 # ------------------
@@ -39,6 +42,23 @@ config_strings['footnote'] = 'Fotnot'
 config_strings['header'] = 'Rubrik'
 config_strings['date'] = 'Datering'
 config_strings['header-poem'] = 'Titel'
+# Compiled stylesheets
+# ------------------
+# Compiled XSLT transforms keyed by (path, mtime_ns, size), so a stylesheet
+# is only compiled once per process and recompiled if the file changes
+xslt_cache = dict()
+# XML parsers
+# ------------------
+# Parsers for loading documents, one per thread as lxml parsers can't be shared between threads
+xml_parsers = threading.local()
+# Compiled xpath expressions
+# ------------------
+# Expressions used for every note or element are compiled once per process,
+# keyed by (expression, namespace prefix, namespace url)
+xpath_cache = dict()
+# Chapter divs around a node, used for every numbered block element
+xpath_chapter_ancestors = ET.XPath('ancestor::' + config['namespace_prefix'] + ':div[@type="chapter"]',
+                                   namespaces={config['namespace_prefix']: config['namespace_url']})
 
 
 # ------------------------------------------------
@@ -61,6 +81,7 @@ class CTeiDocument:
         self.textTypes = config_texttypes
         self.sGenres = config_genres
         self.strings = config_strings
+        self.tNoteAnchors = None  # Note start and end anchors, collected on first use by __GetNoteAnchors
 
     # ------------------------------------------------
     # Loads an xml document from a file
@@ -85,9 +106,10 @@ class CTeiDocument:
         # Move note end anchors (this has previously done as a last step but it should be ok to do it before other processing)
         sXml = self.__MoveEndAnchors(sXml)
         # Create an xml parser, read the xml from string
-        self.xmlTree = ET.ElementTree(ET.fromstring(sXml))
+        self.xmlTree = ET.ElementTree(ET.fromstring(sXml, parser=CTeiDocument.GetXmlParser()))
         # Get root element
         self.xmlRoot = self.xmlTree.getroot()
+        self.tNoteAnchors = None
         # Return success
         return True
 
@@ -154,9 +176,8 @@ class CTeiDocument:
     def __AutoNumberElements(self, bNumberLines):
         # Auto number all block elements
         # Find all paragraph nodes using xpath
-        oNodes = self.xmlRoot.xpath(
-            './/' + self.sPrefix + ':text/' + self.sPrefix + ':body//*[self::' + self.sPrefix + ':p or self::' + self.sPrefix + ':lg or self::' + self.sPrefix + ':list or self::' + self.sPrefix + ':sp or self::' + self.sPrefix + ':castList]',
-            namespaces={self.sPrefix: self.sNamespaceUrl})
+        oNodes = self.GetXPath(
+            './/' + self.sPrefix + ':text/' + self.sPrefix + ':body//*[self::' + self.sPrefix + ':p or self::' + self.sPrefix + ':lg or self::' + self.sPrefix + ':list or self::' + self.sPrefix + ':sp or self::' + self.sPrefix + ':castList]')(self.xmlRoot)
         # Iterate all nodes and number them
         iCounter = 1
         sDivId = ''
@@ -164,8 +185,7 @@ class CTeiDocument:
         sNodePrefix = ''
         for oNode in oNodes:
             # Find possible chapter ancestor div
-            oDivNodes = oNode.xpath('./ancestor::' + self.sPrefix + ':div[@type="chapter"]',
-                                    namespaces={self.sPrefix: self.sNamespaceUrl})
+            oDivNodes = xpath_chapter_ancestors(oNode)
             # If inside chapter, get the id of the chapter
             if len(oDivNodes) > 0:
                 if 'id' in oDivNodes[0].attrib:
@@ -191,7 +211,7 @@ class CTeiDocument:
         # Auto number all lines in poems
         if bNumberLines:
             # Find all div elements
-            oNodes = self.xmlRoot.xpath('.//' + self.sPrefix + ':div', namespaces={self.sPrefix: self.sNamespaceUrl})
+            oNodes = self.GetXPath('.//' + self.sPrefix + ':div')(self.xmlRoot)
             # Iterate all div elements
             for oNode in oNodes:
                 # Check if div is a poem
@@ -200,8 +220,7 @@ class CTeiDocument:
                         # Reset line counter
                         iCounter = 1
                         # Find all lines in the poem
-                        oLineNodes = oNode.xpath('.//' + self.sPrefix + ':l',
-                                                 namespaces={self.sPrefix: self.sNamespaceUrl})
+                        oLineNodes = self.GetXPath('.//' + self.sPrefix + ':l')(oNode)
                         # Iterate all lines and add line numbers, except for lines that are divided into parts, which should be counted as just one line
                         for oLineNode in oLineNodes:
                             if 'part' in oLineNode.attrib:
@@ -224,8 +243,7 @@ class CTeiDocument:
     # Common autonumber
     def __AutoNumber(self, elementName, prefix):
         # Find all table elements
-        oNodes = self.xmlRoot.xpath('.//' + self.sPrefix + ':' + elementName,
-                                    namespaces={self.sPrefix: self.sNamespaceUrl})
+        oNodes = self.GetXPath('.//' + self.sPrefix + ':' + elementName)(self.xmlRoot)
         # Iterate all table elements
         iCounter = 1
         for oNode in oNodes:
@@ -271,11 +289,9 @@ class CTeiDocument:
                 elemClassDecl = ET.SubElement(elemEncodingDesc, 'classDecl')
 
             # Remove taxonomy elements if they exist
-            for elemRemove in elemClassDecl.xpath("//" + self.sPrefix + ":taxonomy[@xml:id='cat_genre']",
-                                                  namespaces={self.sPrefix: self.sNamespaceUrl}):
+            for elemRemove in self.GetXPath("//" + self.sPrefix + ":taxonomy[@xml:id='cat_genre']")(elemClassDecl):
                 elemRemove.getparent().remove(elemRemove)
-            for elemRemove in elemClassDecl.xpath("//" + self.sPrefix + ":taxonomy[@xml:id='cat_editorial']",
-                                                  namespaces={self.sPrefix: self.sNamespaceUrl}):
+            for elemRemove in self.GetXPath("//" + self.sPrefix + ":taxonomy[@xml:id='cat_editorial']")(elemClassDecl):
                 elemRemove.getparent().remove(elemRemove)
 
             # Create genre category element
@@ -315,6 +331,8 @@ class CTeiDocument:
 
         # Declare variables
         sPosition = ''
+        # The comment stylesheet is looked up once per document instead of once per comment
+        transform = None
 
         # Get or create the div node for storing comments
         oBodyNode = self.xmlRoot.find('.//' + self.sPrefixUrl + 'body')
@@ -324,23 +342,26 @@ class CTeiDocument:
         # Iterate all comments
         for comment in ldComments:
 
+            # The note id is turned into a string once, it's used as the anchor key and in the note attributes
+            sNoteId = str(comment['id'])
+
             # Get the position for the note in the main text
-            sPosition = self.__GetNotePosition(cMainText, comment['id'])
-            sPosition = re.sub('cl[0-9]+_', '', sPosition)
-            sPosition = re.sub('lg[0-9]+_', '', sPosition)
-            sPosition = re.sub('list[0-9]+_', '', sPosition)
-            # sPosition = sPosition.replace('l', '')
-            sPosition = re.sub('l([0-9]+)', r'\1', sPosition)
-            sPosition = re.sub('p[0-9]+_', '', sPosition)
+            sPosition = self.__GetNotePosition(cMainText, sNoteId)
 
             # Position will be None if the note was not found in the main text, then we don't add the note.
             if sPosition is not None:
+                sPosition = re.sub('cl[0-9]+_', '', sPosition)
+                sPosition = re.sub('lg[0-9]+_', '', sPosition)
+                sPosition = re.sub('list[0-9]+_', '', sPosition)
+                # sPosition = sPosition.replace('l', '')
+                sPosition = re.sub('l([0-9]+)', r'\1', sPosition)
+                sPosition = re.sub('p[0-9]+_', '', sPosition)
 
                 # Create a note element
                 oNoteNode = ET.SubElement(oDivNode, 'note')
                 oNoteNode.attrib['type'] = 'editor'
-                oNoteNode.attrib['id'] = 'en' + str(comment['id'])
-                oNoteNode.attrib['target'] = '#start' + str(comment['id'])
+                oNoteNode.attrib['id'] = 'en' + sNoteId
+                oNoteNode.attrib['target'] = '#start' + sNoteId
 
                 # Create position and chapter nodes
                 if len(sPosition) > 0:
@@ -356,19 +377,52 @@ class CTeiDocument:
                         oNode.text = 'ch' + sNewDiv
 
                 # Create the lemma node
-                soup = BeautifulSoup(comment['shortenedSelection'].replace('[...]', '<seg type="lemmaBreak">[...]</seg>'), "html.parser")
-                xml_content = ET.fromstring('<seg type="noteLemma">' + str(soup) + '</seg>')
-                oNoteNode.append(xml_content)
+                oNode = ET.SubElement(oNoteNode, 'seg')
+                oNode.attrib['type'] = 'noteLemma'
+                self.__FillLemma(oNode, comment['shortenedSelection'] or '')
 
                 # Create the text node (<seg type="noteText"> is created in the xslt file)
                 try:
-                    xml_content = ET.fromstring(CTeiDocument.HtmlToTeiXml(comment['description'], sXsltPath))
-                    oNoteNode.append(xml_content)
+                    if transform is None:
+                        transform = CTeiDocument.GetXslt(sXsltPath)
+                    xml_content = CTeiDocument.HtmlToTeiElement(comment['description'], sXsltPath, transform)
+                    if xml_content is not None:
+                        oNoteNode.append(xml_content)
                 except Exception as e:
                     print(e)
 
         return True
 
+    # ------------------------------------------------
+    # Fill a lemma node with the shortened selection of a comment,
+    # with every [...] marked as a lemmaBreak seg
+    def __FillLemma(self, oNode, sLemma):
+        # Lemmas without markup, entities or carriage returns are split as they are, only
+        # the rest need to go through the html parser, so that its handling of them is kept
+        # Whitespace-only text around the [...] breaks is also left to the parser, as it may
+        # drop or collapse it depending on the libxml2 version
+        lParts = sLemma.split('[...]')
+        if '<' not in sLemma and '&' not in sLemma and '\r' not in sLemma and \
+                not any(sPart and sPart.isspace() for sPart in lParts):
+            try:
+                oNode.text = lParts[0] or None
+                for sPart in lParts[1:]:
+                    oBreak = ET.SubElement(oNode, 'seg')
+                    oBreak.attrib['type'] = 'lemmaBreak'
+                    oBreak.text = '[...]'
+                    oBreak.tail = sPart or None
+                return
+            except ValueError:
+                # lxml refuses control characters in element text, the lemma is
+                # then built by the html parser path below instead
+                oNode.text = None
+                del oNode[:]
+        sLemma = sLemma.replace('[...]', '<seg type="lemmaBreak">[...]</seg>')
+        oLemma = lxml_html.fragment_fromstring(sLemma, create_parent='seg')
+        oNode.text = oLemma.text
+        for oChild in oLemma:
+            oNode.append(oChild)
+
     # ------------------------------------------------
     # Extract the chapter part of a note position
     def __GetChapter(self, sNotePosition):
@@ -382,52 +436,46 @@ class CTeiDocument:
             return ''
 
     # ------------------------------------------------
-    # Get the note position in the reading text for a specific note id
-    def __GetNotePosition(self, cMainText, iNoteId):
+    # Get the note position in the reading text for a specific note id, given as a string
+    # The anchors are kept by id without their start/end prefix, so the id is looked up as it is
+    def __GetNotePosition(self, cMainText, sNoteId):
         # Temporary variables
         sStart = ''
         sEnd = ''
         # Find the start anchor element for the note id
-        oAnchorNode = cMainText.xmlRoot.xpath('//' + cMainText.sPrefix + ':anchor[@xml:id="start' + str(iNoteId) + '"]',
-                                              namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
-        if len(oAnchorNode) > 0:
+        dStartAnchors, dEndAnchors = cMainText.__GetNoteAnchors()
+        oAnchorNode = dStartAnchors.get(sNoteId)
+        if oAnchorNode is not None:
             # Check if start anchor is inside a foot note
-            oFootNoteNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':note[@place]',
-                                                 namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+            oFootNoteNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':note[@place]')(oAnchorNode)
             if len(oFootNoteNode) > 0:
                 sStart = self.strings['footnote']
             else:
                 # Not inside footnote, check if inside p
-                oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':p[@xml:id]',
-                                                   namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':p[@xml:id]')(oAnchorNode)
                 if len(oParentNode) > 0:
                     sStart = oParentNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
                 else:
                     # Not inside p, check if inside l
-                    oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':l[@n]',
-                                                       namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                    oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':l[@n]')(oAnchorNode)
                     if len(oParentNode) > 0:
                         sStart = 'l' + oParentNode[0].attrib['n']
                     else:
                         # Not inside l, check if inside lg
-                        oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':lg[@xml:id]',
-                                                           namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                        oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':lg[@xml:id]')(oAnchorNode)
                         if len(oParentNode) > 0:
                             sStart = oParentNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
                         else:
                             # Not inside lg, check if inside list
-                            oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':list[@xml:id]',
-                                                               namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                            oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':list[@xml:id]')(oAnchorNode)
                             if len(oParentNode) > 0:
                                 sStart = oParentNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
                             else:
                                 # Not inside list, check if inside head
-                                oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':head',
-                                                                   namespaces={
-                                                                       cMainText.sPrefix: cMainText.sNamespaceUrl})
+                                oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':head')(oAnchorNode)
                                 if len(oParentNode) > 0:
                                     # Check if poem
-                                    poemParentNode = oParentNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':div[@type="poem"]', namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                                    poemParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':div[@type="poem"]')(oParentNode[0])
                                     if 'type' in oParentNode[0].attrib:
                                         if oParentNode[0].attrib['type'] == 'title' and len(poemParentNode) > 0:
                                             sStart = self.strings['header-poem']
@@ -437,41 +485,32 @@ class CTeiDocument:
                                         sStart = self.strings['header']
                                 else:
                                     # Not inside head, check if inside dateline
-                                    oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':dateline',
-                                                                       namespaces={
-                                                                           cMainText.sPrefix: cMainText.sNamespaceUrl})
+                                    oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':dateline')(oAnchorNode)
                                     if len(oParentNode) > 0:
                                         sStart = self.strings['date']
 
             # Find end anchor if not inside a footnote
             if sStart != self.strings['footnote']:
                 # Find the end anchor element for the note id
-                oAnchorNode = cMainText.xmlRoot.xpath(
-                    '//' + cMainText.sPrefix + ':anchor[@xml:id="end' + str(iNoteId) + '"]',
-                    namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
-                if len(oAnchorNode) > 0:
+                oAnchorNode = dEndAnchors.get(sNoteId)
+                if oAnchorNode is not None:
                     # Check if inside p
-                    oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':p[@xml:id]',
-                                                       namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                    oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':p[@xml:id]')(oAnchorNode)
                     if len(oParentNode) > 0:
                         sEnd = oParentNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
                     else:
                         # Not inside p, check if inside l
-                        oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':l[@n]',
-                                                           namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                        oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':l[@n]')(oAnchorNode)
                         if len(oParentNode) > 0:
                             sEnd = 'l' + oParentNode[0].attrib['n']
                         else:
                             # Not inside l, check if inside list
-                            oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':list[@xml:id]',
-                                                               namespaces={cMainText.sPrefix: cMainText.sNamespaceUrl})
+                            oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':list[@xml:id]')(oAnchorNode)
                             if len(oParentNode) > 0:
                                 sEnd = oParentNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
                             else:
                                 # Not inside list, check if inside lg
-                                oParentNode = oAnchorNode[0].xpath('./ancestor::' + cMainText.sPrefix + ':lg[@xml:id]',
-                                                                   namespaces={
-                                                                       cMainText.sPrefix: cMainText.sNamespaceUrl})
+                                oParentNode = cMainText.GetXPath('./ancestor::' + cMainText.sPrefix + ':lg[@xml:id]')(oAnchorNode)
                                 if len(oParentNode) > 0:
                                     sEnd = oParentNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
 
@@ -491,33 +530,53 @@ class CTeiDocument:
     # Get the first found note id in a main text
     # This will be used to find all notes for the document
     def GetFirstNoteId(self):
-        oAnchorNode = self.xmlRoot.xpath('//' + self.sPrefix + ':anchor[starts-with(@xml:id,"start")]',
-                                         namespaces={self.sPrefix: self.sNamespaceUrl})
+        oAnchorNode = self.GetXPath('//' + self.sPrefix + ':anchor[starts-with(@xml:id,"start")]')(self.xmlRoot)
         if len(oAnchorNode) > 0:
             sAtt = oAnchorNode[0].attrib['{http://www.w3.org/XML/1998/namespace}id']
             return sAtt[5:]
         else:
             return None
 
+    # ------------------------------------------------
+    # Returns the ids of all notes in document order, each id only once, or None if there are no notes
     def GetAllNoteIDs(self):
-        oAnchorNode = self.xmlRoot.xpath('//' + self.sPrefix + ':anchor[starts-with(@xml:id,"start")]',
-                                         namespaces={self.sPrefix: self.sNamespaceUrl})
-        if len(oAnchorNode) > 0:
-            note_ids = []
-            for elem in oAnchorNode:
-                id_text = elem.attrib['{http://www.w3.org/XML/1998/namespace}id']
-                note_ids.append(id_text[5:])
-            return note_ids
+        dStartAnchors, dEndAnchors = self.__GetNoteAnchors()
+        if len(dStartAnchors) > 0:
+            # The start anchors are kept by id in the order they were found, so the ids are already unique
+            return list(dStartAnchors)
         else:
             return None
 
+    # ------------------------------------------------
+    # Collects the start and end anchors of all notes in one pass over the document
+    # Returns a tuple of (dict of id to start anchor, dict of id to end anchor), the ids in document order
+    # Only the first anchor for each id is kept, like a '//anchor[@xml:id=...]' lookup would find
+    # The result is kept, as the main text isn't changed anymore when its notes are looked up
+    def __GetNoteAnchors(self):
+        if self.tNoteAnchors is None:
+            dStartAnchors = dict()
+            dEndAnchors = dict()
+            for oNode in self.xmlRoot.iter(self.sPrefixUrl + 'anchor'):
+                sId = oNode.get('{http://www.w3.org/XML/1998/namespace}id')
+                if sId is None:
+                    continue
+                if sId.startswith('start'):
+                    dStartAnchors.setdefault(sId[5:], oNode)
+                elif sId.startswith('end'):
+                    dEndAnchors.setdefault(sId[3:], oNode)
+            self.tNoteAnchors = (dStartAnchors, dEndAnchors)
+        return self.tNoteAnchors
+
     # ------------------------------------------------
     # Process variants, this determines and sets the type attribute of the variants
     # lcTeiDocsToRead is a list of CTeiDocument instances (variants)
     def ProcessVariants(self, lcTeiDocsToRead):
 
         # Get all 'app' nodes
-        oNodes = self.xmlRoot.xpath('.//' + self.sPrefix + ':app', namespaces={self.sPrefix: self.sNamespaceUrl})
+        oNodes = self.GetXPath('.//' + self.sPrefix + ':app')(self.xmlRoot)
+
+        # Index the 'app' nodes of all version documents by id once, instead of searching each document for every node
+        ldAppsById = [cTeiDoc.__GetAppsById() for cTeiDoc in lcTeiDocsToRead]
 
         # Iterate all nodes
         for oNode in oNodes:
@@ -532,12 +591,10 @@ class CTeiDocument:
             # Check if id attribute exists
             if 'id' in oNode.attrib:
                 # Iterate all version documents
-                for cTeiDoc in lcTeiDocsToRead:
+                for dAppsById in ldAppsById:
                     # Search for variant with specific id
-                    oAppNodes = cTeiDoc.xmlRoot.xpath('//' + cTeiDoc.sPrefix + ':app[@id="' + oNode.attrib['id'] + '"]',
-                                                      namespaces={cTeiDoc.sPrefix: cTeiDoc.sNamespaceUrl})
-                    if len(oAppNodes) > 0:
-                        oAppNode = oAppNodes[0]
+                    oAppNode = dAppsById.get(oNode.attrib['id'])
+                    if oAppNode is not None:
                         # If type attribute exists, figure out type
                         if 'type' in oAppNode.attrib:
                             sAppNodeType = oAppNode.attrib['type']
@@ -554,6 +611,15 @@ class CTeiDocument:
 
         return True
 
+    # ------------------------------------------------
+    # Maps the id of every 'app' node to the first 'app' node with that id in document order
+    def __GetAppsById(self):
+        dAppsById = dict()
+        for oAppNode in self.xmlRoot.iter(self.sPrefixUrl + 'app'):
+            if 'id' in oAppNode.attrib:
+                dAppsById.setdefault(oAppNode.attrib['id'], oAppNode)
+        return dAppsById
+
     # ------------------------------------------------
     # Get the main title of the document
     def GetMainTitle(self):
@@ -599,7 +665,7 @@ class CTeiDocument:
 
     # Get or create an xml element
     def __GetOrCreate(self, parent, xpath, elemName):
-        oNodes = parent.xpath(xpath, namespaces={self.sPrefix: self.sNamespaceUrl})
+        oNodes = self.GetXPath(xpath)(parent)
         if len(oNodes) > 0:
             return oNodes[0]
         else:
@@ -742,30 +808,89 @@ class CTeiDocument:
         return True
 
     # ------------------------------------------------
-    # Converts a HTML fragment from the commenting tool to TEI XML
-    # The result is returned as a unicode formatted string
+    # Returns the document as UTF-8 encoded XML, exactly as Save() writes it to file
+    def ToBytes(self):
+        return ET.tostring(ET.ElementTree(self.xmlRoot), encoding="UTF-8", xml_declaration=True)
+
+    # ------------------------------------------------
+    # Gets a compiled xpath expression using the namespace of this document,
+    # compiling it only the first time it's asked for
+    def GetXPath(self, sXPath):
+        tKey = (sXPath, self.sPrefix, self.sNamespaceUrl)
+        oXPath = xpath_cache.get(tKey)
+        if oXPath is None:
+            oXPath = ET.XPath(sXPath, namespaces={self.sPrefix: self.sNamespaceUrl})
+            xpath_cache[tKey] = oXPath
+        return oXPath
+
+    # ------------------------------------------------
+    # Gets the parser used for loading documents in this thread
+    # Elements are only ever matched by id with xpath attribute tests, so the parser doesn't need to
+    # build an id lookup table, and huge_tree lets it read very large texts
+    # Entities are still resolved, as master files may declare their own
+    @staticmethod
+    def GetXmlParser():
+        oParser = getattr(xml_parsers, 'oParser', None)
+        if oParser is None:
+            oParser = ET.XMLParser(collect_ids=False, huge_tree=True)
+            xml_parsers.oParser = oParser
+        return oParser
+
+    # ------------------------------------------------
+    # Gets a compiled XSLT transform for a stylesheet, compiling it only if
+    # it isn't cached yet or the stylesheet file has changed since
+    @staticmethod
+    def GetXslt(sXslPath):
+        oStat = os.stat(sXslPath)
+        key = (sXslPath, oStat.st_mtime_ns, oStat.st_size)
+        transform = xslt_cache.get(key)
+        if transform is None:
+            # Drop outdated versions of the same stylesheet
+            for oldKey in [k for k in xslt_cache if k[0] == sXslPath]:
+                del xslt_cache[oldKey]
+            transform = ET.XSLT(ET.parse(sXslPath))
+            xslt_cache[key] = transform
+        return transform
+
+    # ------------------------------------------------
+    # Converts a HTML fragment from the commenting tool to a TEI XML element
+    # The result is a new element that can be added to a document, or None if there is nothing to add
+    # An already compiled stylesheet for sXslPath can be given as transform
     @staticmethod
-    def HtmlToTeiXml(sHtml, sXslPath):
+    def HtmlToTeiElement(sHtml, sXslPath, transform=None):
         # Declare variables
-        transform = None
-        result = ""
-        # Load the stylesheet
-        xslt_root = ET.parse(sXslPath)
-        transform = ET.XSLT(xslt_root)
-        # Strip empty space from HTML
+        oResult = None
+        # Strip empty space from HTML, an empty comment has nothing to parse or transform
         sHtml = sHtml.strip()
+        if len(sHtml) == 0:
+            return None
+        # Get the (cached) stylesheet
+        if transform is None:
+            transform = CTeiDocument.GetXslt(sXslPath)
         # Do the transformation
-        if len(sHtml) > 0 and transform is not None:
+        if transform is not None:
             try:
-                soup = BeautifulSoup(sHtml, "html.parser")
-                soup.contents[0].unwrap()
-                dom = ET.parse(StringIO("<note>" + str(soup) + "</note>"))
-                newdom = transform(dom)
-                result = ET.tostring(newdom, encoding='unicode')
+                oResult = CTeiDocument.__TransformHtml(sHtml, transform)
             except Exception as e:
                 print(e)
-        # Return as TEI xml
-        return result
+        # The memoized element is shared between calls, so hand out a copy of it
+        if oResult is None:
+            return None
+        return copy.deepcopy(oResult)
+
+    # ------------------------------------------------
+    # Does the actual HTML to TEI conversion for HtmlToTeiElement
+    # The results are memoized, since the same comment texts recur across publications,
+    # and the compiled stylesheet is part of the key so a changed stylesheet isn't served stale results
+    @staticmethod
+    @functools.lru_cache(maxsize=8192)
+    def __TransformHtml(sHtml, transform):
+        # Parse the fragment into a <note> root and unwrap the first element (usually a <p>)
+        oNote = lxml_html.fragment_fromstring(sHtml, create_parent="note")
+        if len(oNote) > 0 and not oNote.text:
+            oNote[0].drop_tag()
+        # Keep the resulting element, rather than serializing it for the caller to parse again
+        return transform(ET.ElementTree(oNote)).getroot()
 
     # ------------------------------------------------
     # Removes delSpans and elements "inside" delSpan element
@@ -773,18 +898,20 @@ class CTeiDocument:
     def RemoveDelSpans(sXml):
         sXml = sXml.decode('utf-8')
         # Initialise temporary variables
-        xmlOut = ''
+        # The parts of the document that are kept are collected in a list and joined once at the end,
+        # instead of growing a string for every delSpan
+        lParts = []
         position = 0
         currentPosition = 0
         # Remove "children" of all delSpan elements
         position = sXml.find('<delSpan')
         while position >= 0:
-            xmlOut += sXml[currentPosition:position]
+            lParts.append(sXml[currentPosition:position])
             endPosition = sXml.find('id="del', position)
             currentPosition = sXml.find('>', endPosition) + 1
             position = sXml.find('<delSpan', currentPosition)
         position = len(sXml)
-        xmlOut += sXml[currentPosition:position]
+        lParts.append(sXml[currentPosition:position])
         # Return the result
-        xmlOut = xmlOut.encode('utf-8')
+        xmlOut = ''.join(lParts).encode('utf-8')
         return xmlOut
@@ -1,13 +1,16 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
 import logging
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.sql import text
+from sqlalchemy.sql import bindparam, text
+import stat
 from subprocess import CalledProcessError
 import sys
 from typing import Union
 
-from sls_api.endpoints.generics import calculate_checksum, config, db_engine, get_project_id_from_name
+from sls_api.endpoints.generics import CHECKSUM_ALGORITHM, calculate_checksum, config, db_engine, get_project_id_from_name
 from sls_api.endpoints.tools.files import run_git_command, update_files_in_git_repo
 from sls_api.scripts.CTeiDocument import CTeiDocument
 
@@ -17,127 +20,429 @@ logger.setLevel(logging.DEBUG)
 
 valid_projects = [project for project in config if isinstance(config[project], dict) and config[project].get("comments_database", False)]
 
-comment_db_engines = {project: create_engine(config[project]["comments_database"], pool_pre_ping=True) for project in valid_projects}
+# engines for the comments databases, only created for the projects that are actually published
+comment_db_engines = dict()
+
+
+def get_comment_db_engine(project):
+    """
+    Returns the engine for the comments database of the given project, creating it the first time it's needed
+    """
+    engine = comment_db_engines.get(project)
+    if engine is None:
+        engine = create_engine(config[project]["comments_database"], pool_pre_ping=True, pool_use_lifo=True)
+        comment_db_engines[project] = engine
+    return engine
+
 
 COMMENTS_XSL_PATH_IN_FILE_ROOT = "xslt/comment_html_to_tei.xsl"
 COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT = "templates/comment.xml"
+# number of publication/manuscript rows fetched from the database at a time while checking them
+DATABASE_FETCH_BATCH_SIZE = 500
+# size of the blocks in which existing web XML files are compared to newly generated contents
+FILE_COMPARE_BLOCK_SIZE = 1024 * 1024
+# number of threads used to load the variant files of a publication
+DOCUMENT_LOAD_THREADS = 4
+# number of changed files given to a single "git add", keeping the command line well below the system's length limit
+GIT_ADD_BATCH_SIZE = 1000
+
+# comment and correspondence lookups, built once and executed with a list of IDs
+# the ID lists are expanding parameters, so the compiled statements are reused no matter how many IDs are given
+COMMENTS_STATEMENT = text("SELECT documentnote.id, documentnote.shortenedSelection, note.description \
+                          FROM documentnote INNER JOIN note ON documentnote.note_id = note.id \
+                          WHERE documentnote.deleted = 0 AND note.deleted = 0 AND documentnote.id IN :docnote_ids") \
+    .bindparams(bindparam("docnote_ids", expanding=True))
+# the title, persons and locations of letters are fetched in one round-trip, the title rows are the ones without a type
+LETTER_STATEMENT = text("SELECT c.legacy_id, NULL AS type, c.id, c.title AS name from correspondence c \
+                        where c.legacy_id IN :letter_ids \
+                        UNION ALL \
+                        SELECT c.legacy_id, ec.type, s.id, s.full_name from correspondence c \
+                        join event_connection ec on ec.correspondence_id = c.id \
+                        join subject s on s.id = ec.subject_id \
+                        where c.legacy_id IN :letter_ids and ec.type IN ('avsändare', 'mottagare') \
+                        UNION ALL \
+                        SELECT c.legacy_id, ec.type, l.id, l.name from correspondence c \
+                        join event_connection ec on ec.correspondence_id = c.id \
+                        join location l on l.id = ec.location_id \
+                        where c.legacy_id IN :letter_ids and ec.type IN ('avsändarort', 'mottagarort') ") \
+    .bindparams(bindparam("letter_ids", expanding=True))
+# publication_version with type=1 is the "main" variant, the others should have type=2 and be versions of that main variant
+VARIANTS_STATEMENT = text("SELECT publication_id, id, original_filename, type \
+                          FROM publication_version \
+                          WHERE publication_version.publication_id IN :pub_ids AND publication_version.type IN (1, 2) AND publication_version.deleted != 1") \
+    .bindparams(bindparam("pub_ids", expanding=True))
+
+
+# os.stat() results for source files, kept for the duration of one publishing run,
+# as the same source files (e.g. the comments template) are checked for many publications
+# None is stored for files that don't exist, so missing files aren't looked up again either
+source_stat_cache = dict()
+
+
+def cached_source_stat(path):
+    """
+    Returns os.stat() for the given source file, or None if it doesn't exist or can't be accessed.
+    Only asks the filesystem the first time during a publishing run.
+    """
+    try:
+        return source_stat_cache[path]
+    except KeyError:
+        pass
+    try:
+        result = os.stat(path)
+    except OSError:
+        result = None
+    source_stat_cache[path] = result
+    return result
 
 
-def get_comments_from_database(project, document_note_ids):
-    if document_note_ids is None:
-        return []
+def source_exists(path):
     """
-    Given the name of a project and a list of IDs of comments in a master file, returns data from the comments database with matching documentnote.id
-    Returns a list of dicts, each dict representing one comment.
+    Returns True if the given source file exists, like os.path.exists() but using cached_source_stat()
     """
-    connection = comment_db_engines[project].connect()
+    return cached_source_stat(path) is not None
 
-    comment_query = text("SELECT documentnote.id, documentnote.shortenedSelection, note.description \
-                         FROM documentnote INNER JOIN note ON documentnote.note_id = note.id \
-                         WHERE documentnote.deleted = 0 AND note.deleted = 0 AND documentnote.id IN :docnote_ids")
-    comment_query = comment_query.bindparams(docnote_ids=tuple(document_note_ids))
-    comments = connection.execute(comment_query).fetchall()
-    connection.close()
-    if len(comments) <= 0:
-        return []
-    return [comment._asdict() for comment in comments if comment is not None]
 
+def source_is_dir(path):
+    """
+    Returns True if the given source path is a directory, like os.path.isdir() but using cached_source_stat()
+    """
+    result = cached_source_stat(path)
+    return result is not None and stat.S_ISDIR(result.st_mode)
 
-def get_letter_info_from_database(letter_id):
-    logger.info("Getting correspondence info for letter: {}".format(letter_id))
-    if letter_id is None:
+
+# os.scandir() entries of the folders generated files are written to, kept for the duration of one publishing run
+# Each folder is listed once, so generated files that don't exist yet are known without looking each one up separately
+# All generated files are checked before any of them are written, so the listings stay valid during the checks
+target_folder_cache = dict()
+
+
+def get_target_stat(path):
+    """
+    Returns os.stat() for the given generated file, using a cached listing of its folder.
+    Raises OSError if the file doesn't exist.
+    """
+    folder, filename = os.path.split(path)
+    entries = target_folder_cache.get(folder)
+    if entries is None:
+        try:
+            with os.scandir(folder) as folder_entries:
+                entries = {entry.name: entry for entry in folder_entries}
+        except OSError:
+            entries = dict()
+        target_folder_cache[folder] = entries
+    entry = entries.get(filename)
+    if entry is None:
+        raise FileNotFoundError(path)
+    return entry.stat()
+
+
+def get_target_mtime(path):
+    """
+    Returns the time_modified of the given generated file, like os.path.getmtime() but using get_target_stat()
+    """
+    return get_target_stat(path).st_mtime
+
+
+# checksums of source files, kept for the duration of one publishing run like source_stat_cache
+source_checksum_cache = dict()
+# checksums of source files from earlier publishing runs, as [size, mtime_ns, checksum] keyed by path
+# this is kept in the publisher state, so a file is only read again once its size or time_modified has changed
+stored_source_checksums = dict()
+
+
+def cached_source_checksum(path):
+    """
+    Returns calculate_checksum() for the given source file, only reading the file the first time during a publishing run,
+    and not at all if it hasn't been modified since its checksum was stored during an earlier run.
+    Raises OSError if the file can't be read.
+    """
+    result = source_checksum_cache.get(path)
+    if result is None:
+        source_stat = cached_source_stat(path)
+        stored = stored_source_checksums.get(path)
+        if source_stat is not None and stored is not None and stored[:2] == [source_stat.st_size, source_stat.st_mtime_ns]:
+            result = stored[2]
+        else:
+            result = calculate_checksum(path)
+            if source_stat is not None:
+                stored_source_checksums[path] = [source_stat.st_size, source_stat.st_mtime_ns, result]
+        source_checksum_cache[path] = result
+    return result
+
+
+def file_has_content(path, content, path_stat=None):
+    """
+    Returns True if the file at path contains exactly the given bytes.
+    The file is only read if it has the same size, and then in blocks, stopping at the first block that differs.
+    If the file has already been stat'ed, the result can be given as path_stat so it isn't stat'ed again.
+    """
+    try:
+        if path_stat is None:
+            path_stat = os.stat(path)
+        if path_stat.st_size != len(content):
+            return False
+    except FileNotFoundError:
+        return False
+    content_view = memoryview(content)
+    with open(path, "rb") as existing_file:
+        for offset in range(0, len(content), FILE_COMPARE_BLOCK_SIZE):
+            if existing_file.read(FILE_COMPARE_BLOCK_SIZE) != content_view[offset:offset + FILE_COMPARE_BLOCK_SIZE]:
+                return False
+    return True
+
+
+def save_document(document, path, path_stat=None):
+    """
+    Saves a CTeiDocument to path, returning True if this changed the contents of the file (or the file didn't exist before).
+    The new contents are compared to the existing file first, so the written file never has to be read back,
+    and a file that already has the same contents isn't rewritten, only marked as up to date.
+    An os.stat() result for the existing file can be given as path_stat, see file_has_content()
+    """
+    content = document.ToBytes()
+    if file_has_content(path, content, path_stat=path_stat):
+        os.utime(path)
+        return False
+    with open(path, "wb") as target_file:
+        target_file.write(content)
+    return True
+
+
+def get_publisher_state_path(file_root):
+    """
+    Returns the path of the file used to remember the inputs of generated est/com files between publishing runs.
+    The file is kept inside the .git directory of the project, so it never ends up in a commit.
+    Returns None if file_root isn't a git repository, in which case no state is kept.
+    """
+    git_dir = os.path.join(file_root, ".git")
+    if not os.path.isdir(git_dir):
+        return None
+    return os.path.join(git_dir, "publisher_state.json")
+
+
+def load_publisher_state(state_path):
+    """
+    Returns the publisher state saved at state_path as a dict, or an empty dict if there is no usable state.
+    """
+    if state_path is None:
+        return dict()
+    try:
+        with open(state_path, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return dict()
+    if not isinstance(state, dict):
+        return dict()
+    return state
+
+
+def save_publisher_state(state_path, state):
+    """
+    Writes the publisher state to state_path, replacing the old file only once the new one is completely written.
+    Nothing is written if the saved state is already the same, as is the case for runs where nothing was generated.
+    """
+    if state_path is None:
+        return
+    content = json.dumps(state).encode("utf-8")
+    temp_path = "{}.tmp".format(state_path)
+    try:
+        if file_has_content(state_path, content):
+            return
+        with open(temp_path, "wb") as state_file:
+            state_file.write(content)
+        os.replace(temp_path, state_path)
+    except OSError:
+        logger.exception("Failed to save publisher state to {}".format(state_path))
+
+
+def get_metadata_fingerprint(publication_info):
+    """
+    Returns the publication values that SetMetadata() writes into generated files, as strings that can be saved in the publisher state.
+    """
+    return [None if publication_info[key] is None else str(publication_info[key])
+            for key in ("original_publication_date", "p_id", "name", "genre", "c_id", "publication_group_id")]
+
+
+def get_est_and_com_fingerprint(publication_info, est_source_file_path, com_source_file_path, com_xsl_path):
+    """
+    Returns the checksums of all files that est/com files are generated from: the reading text, the comments file and the comments XSLT,
+    along with the publication metadata written into them.
+    """
+    fingerprint = [cached_source_checksum(est_source_file_path), cached_source_checksum(com_source_file_path)]
+    if source_exists(com_xsl_path):
+        fingerprint.append(cached_source_checksum(com_xsl_path))
+    fingerprint.append(get_metadata_fingerprint(publication_info))
+    return fingerprint
+
+
+def est_and_com_sources_unchanged(publication_info, est_source_file_path, com_source_file_path, com_xsl_path,
+                                  est_target_file_path, com_target_file_path, est_fingerprints):
+    """
+    Returns True if the sources and metadata of an outdated est/com pair are the same as when the files were last generated.
+    The generated files are then marked as up to date, so that they aren't checked again on the next run.
+    """
+    publication_id = publication_info["p_id"]
+    try:
+        fingerprint = get_est_and_com_fingerprint(publication_info, est_source_file_path, com_source_file_path, com_xsl_path)
+    except OSError:
+        return False
+    if est_fingerprints.get(est_target_file_path) != fingerprint:
+        return False
+    logger.info("Sources for publication {} are unchanged, keeping existing est/com files.".format(publication_id))
+    try:
+        os.utime(est_target_file_path)
+        os.utime(com_target_file_path)
+    except OSError:
+        logger.warning("Failed to update time_modified for est/com files for publication {}".format(publication_id))
+    return True
+
+
+def get_ms_fingerprint(publication_info, source_file_path):
+    """
+    Returns the checksum of the source an ms file is generated from, along with the publication metadata written into it.
+    """
+    return [cached_source_checksum(source_file_path), get_metadata_fingerprint(publication_info)]
+
+
+def ms_source_unchanged(publication_info, source_file_path, target_file_path, ms_fingerprints):
+    """
+    Returns True if the source and metadata of an outdated ms file are the same as when the file was last generated.
+    The generated file is then marked as up to date, so that it isn't checked again on the next run.
+    """
+    manuscript_id = publication_info["m_id"]
+    try:
+        fingerprint = get_ms_fingerprint(publication_info, source_file_path)
+    except OSError:
+        return False
+    if ms_fingerprints.get(target_file_path) != fingerprint:
+        return False
+    logger.info("Source for manuscript {} is unchanged, keeping existing ms file.".format(manuscript_id))
+    try:
+        os.utime(target_file_path)
+    except OSError:
+        logger.warning("Failed to update time_modified for ms file for manuscript {}".format(manuscript_id))
+    return True
+
+
+def get_comments_from_database(project, document_note_ids, connection=None):
+    """
+    Given the name of a project and a list of IDs of comments in a master file, returns data from the comments database with matching documentnote.id
+    Returns a list of dict-like row mappings, each representing one comment.
+    If a connection to the comments database is given, it is used (and left open), otherwise a new connection is opened and closed.
+    """
+    if document_note_ids is None:
         return []
-    letter = dict()
-    # Get Sender
-    sender = get_letter_person(letter_id, 'avsändare')
-    if sender is not None:
-        letter['sender'] = sender.full_name
-        letter['sender_id'] = sender.id
-    else:
-        letter['sender'] = ''
-        letter['sender_id'] = ''
-    # Get Reciever
-    reciever = get_letter_person(letter_id, 'mottagare')
-    if reciever is not None:
-        letter['reciever'] = reciever.full_name
-        letter['reciever_id'] = reciever.id
-    else:
-        letter['reciever'] = ''
-        letter['reciever_id'] = ''
-    # Get Sender Location
-    sender_location = get_letter_location(letter_id, 'avsändarort')
-    if sender_location is not None:
-        letter['sender_location'] = sender_location.name
-        letter['sender_location_id'] = sender_location.id
-    else:
-        letter['sender_location'] = ''
-        letter['sender_location_id'] = ''
-    # Get Reciever Location
-    reciever_location = get_letter_location(letter_id, 'mottagarort')
-    if reciever_location is not None:
-        letter['reciever_location'] = reciever_location.name
-        letter['reciever_location_id'] = reciever_location.id
-    else:
-        letter['reciever_location'] = ''
-        letter['reciever_location_id'] = ''
-    # Get Title and Status
-    title = get_letter_info(letter_id)
-    if title is not None:
-        letter['title'] = title.title
-        letter['title_id'] = title.id
+    return get_comments_from_database_bulk(project, {None: document_note_ids}, connection=connection)[None]
+
+
+def get_comments_from_database_bulk(project, document_note_ids_map, connection=None):
+    """
+    Given the name of a project and a dict of keys (e.g. publication IDs) to lists of IDs of comments in master files,
+    fetches all the comments from the comments database in one query.
+    Returns a dict with the same keys, mapping each key to a list of dict-like row mappings, each representing one comment.
+    If a connection to the comments database is given, it is used (and left open), otherwise a new connection is opened and closed.
+    """
+    # note IDs are read from the master files as strings, so compare them as strings
+    # map each ID to the keys it was requested for, so rows can be handed out in one pass
+    keys_by_id = dict()
+    for key, note_ids in document_note_ids_map.items():
+        if note_ids is None:
+            continue
+        for note_id in note_ids:
+            keys = keys_by_id.setdefault(str(note_id), [])
+            if key not in keys:
+                keys.append(key)
+    result = {key: [] for key in document_note_ids_map}
+    if len(keys_by_id) <= 0:
+        return result
+
+    if connection is None:
+        connection = get_comment_db_engine(project).connect()
+        new_connection = True
     else:
-        letter['title'] = ''
-        letter['title_id'] = ''
-    return letter
+        new_connection = False
 
+    try:
+        comments = connection.execute(COMMENTS_STATEMENT, {"docnote_ids": list(keys_by_id)}).mappings().fetchall()
+    finally:
+        if new_connection:
+            connection.close()
+        else:
+            # end the implicit transaction, so a reused connection doesn't keep an old snapshot or a failed state
+            connection.rollback()
 
-def get_letter_info(letter_id):
-    if letter_id is None:
-        return []
-    connection = db_engine.connect()
-    statement = text("SELECT c.id, c.title from correspondence c \
-                     where c.legacy_id = :letter_id ")
-    statement = statement.bindparams(letter_id=letter_id)
-    data = connection.execute(statement).fetchone()
-    connection.close()
-    return data
+    # the rows are handed out as they are, as read-only mappings they can be used like dicts without copying
+    for comment in comments:
+        for key in keys_by_id.get(str(comment["id"]), []):
+            result[key].append(comment)
+    return result
 
 
-def get_letter_person(letter_id, type):
-    if letter_id is None:
-        return []
-    if type not in ['mottagare', 'avsändare']:
-        return []
-    connection = db_engine.connect()
-    statement = text("SELECT s.id, s.full_name from correspondence c \
-                     join event_connection ec on ec.correspondence_id = c.id \
-                     join subject s on s.id = ec.subject_id \
-                     where c.legacy_id = :letter_id and ec.type = :type ")
-    statement = statement.bindparams(letter_id=letter_id, type=type)
-    data = connection.execute(statement).fetchone()
-    connection.close()
-    return data
-
-
-def get_letter_location(letter_id, type):
+def get_letter_info_from_database(letter_id, connection=None):
+    """
+    Given the legacy ID of a letter, returns a dict with the title, sender, reciever and their locations from the correspondence tables.
+    If a database connection is given, it is used (and left open), otherwise a new connection is opened and closed.
+    """
+    logger.info("Getting correspondence info for letter: {}".format(letter_id))
     if letter_id is None:
         return []
-    if type not in ['mottagarort', 'avsändarort']:
-        return []
-    connection = db_engine.connect()
-    statement = text("SELECT l.id, l.name from correspondence c \
-                     join event_connection ec on ec.correspondence_id = c.id \
-                     join location l on l.id = ec.location_id \
-                     where c.legacy_id = :letter_id and ec.type = :type ")
-    statement = statement.bindparams(letter_id=letter_id, type=type)
-    data = connection.execute(statement).fetchone()
-    connection.close()
-    return data
+    return get_letter_info_for_many([letter_id], connection=connection)[str(letter_id)]
 
 
-def generate_est_and_com_files(publication_info, project, est_master_file_path, com_master_file_path, est_target_path, com_target_path, com_xsl_path=None):
+def get_letter_info_for_many(letter_ids, connection=None):
+    """
+    Given a list of letter legacy IDs, fetches the correspondence info for all of them in one query.
+    Returns a dict mapping each legacy ID (as a string) to a dict like the one returned by get_letter_info_from_database
+    If a database connection is given, it is used (and left open), otherwise a new connection is opened and closed.
+    """
+    letter_ids = list(dict.fromkeys(str(letter_id) for letter_id in letter_ids if letter_id is not None))
+    letters = {letter_id: dict() for letter_id in letter_ids}
+    if len(letter_ids) <= 0:
+        return letters
+
+    if connection is None:
+        connection = db_engine.connect()
+        new_connection = True
+    else:
+        new_connection = False
+    try:
+        rows = connection.execute(LETTER_STATEMENT, {"letter_ids": letter_ids}).fetchall()
+    finally:
+        if new_connection:
+            connection.close()
+        else:
+            # end the implicit transaction, so a reused connection isn't left idle in a transaction
+            connection.rollback()
+
+    # only the first match for each letter and type is used
+    found_titles = dict()
+    found_events = dict()
+    for row in rows:
+        if row.type is None:
+            found_titles.setdefault(str(row.legacy_id), row)
+        else:
+            found_events.setdefault((str(row.legacy_id), row.type), (row.name, row.id))
+
+    for letter_id, letter in letters.items():
+        for key, event_type in (('sender', 'avsändare'), ('reciever', 'mottagare'),
+                                ('sender_location', 'avsändarort'), ('reciever_location', 'mottagarort')):
+            letter[key], letter[key + '_id'] = found_events.get((letter_id, event_type), ('', ''))
+        title = found_titles.get(letter_id)
+        if title is not None:
+            letter['title'] = title.name
+            letter['title_id'] = title.id
+        else:
+            letter['title'] = ''
+            letter['title_id'] = ''
+    return letters
+
+
+def generate_est_and_com_files(publication_info, project, est_master_file_path, com_master_file_path, est_target_path, com_target_path, com_xsl_path=None,
+                               comment_connection=None, connection=None):
     """
     Given a project name, and paths to valid EST/COM masters and targets, regenerates target files based on source files
+    Returns a list of the target files whose contents changed
+    Optionally takes an open connection to the project comments database and to the main database, to be reused between publications
     """
     # Generate est file for this document
     est_document = CTeiDocument()
@@ -153,21 +458,23 @@ def generate_est_and_com_files(publication_info, project, est_master_file_path,
                                  publication_info['genre'], 'est', publication_info['c_id'], publication_info['publication_group_id'])
         letterId = est_document.GetLetterId()
         if letterId is not None:
-            letterData = get_letter_info_from_database(letterId)
+            letterData = get_letter_info_from_database(letterId, connection=connection)
             est_document.SetLetterTitleAndStatusAndMeta(letterData)
 
-    est_document.Save(est_target_path)
+    changed_files = []
+    if save_document(est_document, est_target_path):
+        changed_files.append(est_target_path)
 
     # Get all documentnote IDs from the main master file (these are the IDs of the comments for this document)
     note_ids = est_document.GetAllNoteIDs()
     # Use these note_ids to get all comments for this publication from the notes database
-    comments = get_comments_from_database(project, note_ids)
+    comments = get_comments_from_database(project, note_ids, connection=comment_connection)
 
     # generate comments file for this document
     com_document = CTeiDocument()
 
     # if com_master_file_path doesn't exist, use COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT
-    if not os.path.exists(com_master_file_path):
+    if not source_exists(com_master_file_path):
         com_master_file_path = os.path.join(
             config[project]["file_root"], COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT)
 
@@ -176,7 +483,7 @@ def generate_est_and_com_files(publication_info, project, est_master_file_path,
         com_document.Load(com_master_file_path)
 
         # if com_xsl_path is invalid or not given, try using COMMENTS_XSL_PATH_IN_FILE_ROOT
-        if com_xsl_path is None or not os.path.exists(com_xsl_path):
+        if com_xsl_path is None or not source_exists(com_xsl_path):
             com_xsl_path = os.path.join(
                 config[project]["file_root"], COMMENTS_XSL_PATH_IN_FILE_ROOT)
 
@@ -188,31 +495,40 @@ def generate_est_and_com_files(publication_info, project, est_master_file_path,
             com_document.SetMetadata(publication_info['original_publication_date'], publication_info['p_id'], publication_info['name'],
                                      publication_info['genre'], 'com', publication_info['c_id'], publication_info['publication_group_id'])
 
-        com_document.Save(com_target_path)
+        if save_document(com_document, com_target_path):
+            changed_files.append(com_target_path)
     except Exception as ex:
         logger.exception("Failed to handle com master file: {}".format(com_master_file_path))
         raise ex
+    return changed_files
 
 
 def process_var_documents_and_generate_files(main_var_doc, main_var_path, var_docs, var_paths, publication_info):
     """
     Process generated CTeiDocument objects - comparing each var_doc in var_docs to the main_var_doc and saving target files
+    Returns a list of the target files whose contents changed
     """
     # First, compare the main variant against all other variants
     main_var_doc.ProcessVariants(var_docs)
     if publication_info is not None:
         main_var_doc.SetMetadata(publication_info['original_publication_date'], publication_info['p_id'], publication_info['name'],
                                  publication_info['genre'], 'com', publication_info['c_id'], publication_info['publication_group_id'])
+    changed_files = []
     # Then save main variant web XML file
-    main_var_doc.Save(main_var_path)
+    if save_document(main_var_doc, main_var_path):
+        changed_files.append(main_var_path)
     # lastly, save all other variant web XML files
     for var_doc, var_path in zip(var_docs, var_paths):
-        var_doc.Save(var_path)
+        if save_document(var_doc, var_path):
+            changed_files.append(var_path)
+    return changed_files
 
 
-def generate_ms_file(master_file_path, target_file_path, publication_info):
+def generate_ms_file(master_file_path, target_file_path, publication_info, target_stat=None):
     """
     Given a project name, and valid master and target file paths for a publication manuscript, regenerates target file based on source file
+    Returns a list with the target file if its contents changed
+    If the existing target file was already stat'ed, the result can be given as target_stat
     """
     try:
         ms_document = CTeiDocument()
@@ -225,14 +541,297 @@ def generate_ms_file(master_file_path, target_file_path, publication_info):
     if publication_info is not None:
         ms_document.SetMetadata(publication_info['original_publication_date'], publication_info['p_id'], publication_info['name'],
                                 publication_info['genre'], 'com', publication_info['c_id'], publication_info['publication_group_id'])
-    ms_document.Save(target_file_path)
+    if save_document(ms_document, target_file_path, path_stat=target_stat):
+        return [target_file_path]
+    return []
+
 
+def publish_est_and_com_files(job, comment_connection=None, connection=None):
+    """
+    Regenerates the est and com files for one publication, given a tuple of
+    (publication_info, project, est_source_file_path, com_source_file_path, est_target_file_path, com_target_file_path)
+    Returns a list of the target files that actually changed, or None if the files couldn't be generated.
+    Optionally takes an open connection to the project comments database and to the main database, to be reused between publications
+    """
+    publication_info, project, est_source_file_path, com_source_file_path, est_target_file_path, com_target_file_path = job
+    try:
+        # only files that actually changed are reported
+        return generate_est_and_com_files(publication_info, project, est_source_file_path, com_source_file_path,
+                                          est_target_file_path, com_target_file_path,
+                                          comment_connection=comment_connection, connection=connection)
+    except Exception:
+        logger.exception("Failed to generate est/com files for publication {}!".format(publication_info["p_id"]))
+        return None
 
-def check_publication_mtimes_and_publish_files(project: str, publication_ids: Union[tuple, None], git_author: str, no_git=False, force_publish=False, is_multilingual=False):
+
+def publish_est_and_com_file_group(job_group, get_connections):
+    """
+    Regenerates the est and com files for a group of jobs, given a list of (index, job) tuples, one job after another.
+    The est/com jobs of a publication with texts in several languages all write the same com file, so they're grouped
+    to never be run at the same time in different worker processes.
+    get_connections is called with the project name for each job and returns a (comment_connection, connection) tuple,
+    if it fails the job fails the same way as if its files couldn't be generated.
+    Returns a list of (index, result) tuples, with the result of publish_est_and_com_files() for each job.
+    """
+    results = []
+    for index, job in job_group:
+        try:
+            comment_connection, connection = get_connections(job[1])
+        except Exception:
+            logger.exception("Failed to connect to the database for publication {}!".format(job[0]["p_id"]))
+            results.append((index, None))
+            continue
+        results.append((index, publish_est_and_com_files(job, comment_connection=comment_connection, connection=connection)))
+    return results
+
+
+def publish_ms_file(job):
+    """
+    Regenerates the ms file for one publication manuscript, given a tuple of (source_file_path, target_file_path, publication_info, target_stat)
+    target_stat is the os.stat() result for the existing target file, or None if it wasn't stat'ed while checking the manuscript
+    Returns a list with the target file if it actually changed, or None if the file couldn't be generated.
+    """
+    source_file_path, target_file_path, publication_info, target_stat = job
+    try:
+        # only report the file as changed if it actually changed
+        return generate_ms_file(source_file_path, target_file_path, publication_info, target_stat=target_stat)
+    except Exception:
+        return None
+
+
+def get_variants_from_database(publication_ids, connection=None):
+    """
+    Given a list of publication IDs, fetches the variants (publication_version rows) of all of them in one query.
+    Returns a dict mapping each publication ID to a tuple of (main variant row or None, list of other variant rows)
+    If a database connection is given, it is used (and left open), otherwise a new connection is opened and closed.
+    """
+    publication_ids = list(dict.fromkeys(publication_ids))
+    variants = {publication_id: (None, []) for publication_id in publication_ids}
+    if len(publication_ids) <= 0:
+        return variants
+
+    if connection is None:
+        connection = db_engine.connect()
+        new_connection = True
+    else:
+        new_connection = False
+    try:
+        rows = connection.execute(VARIANTS_STATEMENT, {"pub_ids": publication_ids}).mappings().fetchall()
+    finally:
+        if new_connection:
+            connection.close()
+        else:
+            # end the implicit transaction, so a reused connection isn't left idle in a transaction
+            connection.rollback()
+
+    for row in rows:
+        main_variant, other_variants = variants[row["publication_id"]]
+        if row["type"] == 1:
+            # should only be one main variant per publication, use the first one found
+            if main_variant is None:
+                variants[row["publication_id"]] = (row, other_variants)
+        else:
+            other_variants.append(row)
+    return variants
+
+
+def load_document(path):
+    """
+    Returns a new CTeiDocument loaded from the given file
+    """
+    document = CTeiDocument()
+    document.Load(path)
+    return document
+
+
+def load_documents(paths):
+    """
+    Returns a list of CTeiDocuments loaded from the given files, in the same order.
+    Several files are read and parsed side by side in a pool of threads, CTeiDocument uses a separate parser for each thread.
+    """
+    if len(paths) <= 1:
+        return [load_document(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(DOCUMENT_LOAD_THREADS, len(paths))) as executor:
+        return list(executor.map(load_document, paths))
+
+
+def publish_variant_files(publication_info, file_root, force_publish=False, connection=None, variants=None):
+    """
+    Checks the variants of a publication and regenerates their web XML files if needed
+    Returns a list of the variant files that actually changed
+    The variants of the publication can be given as returned by get_variants_from_database, otherwise they are fetched.
+    If a database connection is given, it is used (and left open), otherwise a new connection is opened and closed.
+    """
+    publication_id = publication_info["p_id"]
+    collection_id = publication_info["c_id"]
+
+    if variants is None:
+        variants = get_variants_from_database([publication_id], connection=connection)[publication_id]
+    main_variant_info, variants_info = variants
+
+    if main_variant_info is None:
+        logger.warning("No main variant found for publication {}!".format(publication_id))
+        return []
+    logger.debug(f"Main variant query result: {str(dict(main_variant_info))}")
+
+    # compile info and generate files if needed
+    if main_variant_info["original_filename"] is None:
+        return []
+
+    main_variant_source = os.path.join(file_root, main_variant_info["original_filename"])
+
+    if not main_variant_source:
+        logger.warning("Source file for main variant {} is not set.".format(main_variant_info["id"]))
+        return []
+
+    if source_is_dir(main_variant_source):
+        logger.error("Source file {} for main variant {} (type=1) is a directory!".format(main_variant_source, main_variant_info["id"]))
+        return []
+
+    if not source_exists(main_variant_source):
+        logger.error("Source file {} for main variant {} (type=1) does not exist!".format(main_variant_source, main_variant_info["id"]))
+        return []
+
+    # folder for the generated variant files, joined once for all variants of the publication
+    var_target_folder = os.path.join(file_root, "xml", "var")
+    target_filename = "{}_{}_var_{}.xml".format(collection_id,
+                                                publication_id,
+                                                main_variant_info["id"])
+
+    main_variant_target = os.path.join(var_target_folder, target_filename)
+
+    # For each "other" variant, collect the files that need a new CTeiDocument, they are all loaded at once below
+    variant_sources = []
+    variant_paths = []
+    for variant in variants_info:
+        variant_id = variant["id"]
+        source_filename = variant["original_filename"]
+        if source_filename is None:
+            continue
+        if not source_filename:
+            logger.error("Source file for variant {} is not set.".format(variant_id))
+            continue
+        # the target filename is only built for variants that have a source file
+        target_filename = "{}_{}_var_{}.xml".format(collection_id,
+                                                    publication_id,
+                                                    variant_id)
+        target_file_path = os.path.join(var_target_folder, target_filename)
+        # original_filename should be relative to the project root
+        source_file_path = os.path.join(file_root, source_filename)
+
+        if source_is_dir(source_file_path):
+            logger.error("Source file {} for variant {} is a directory!".format(source_file_path, variant_id))
+            continue
+        if not source_exists(source_file_path):
+            logger.error("Source file {} for variant {} does not exist!".format(source_file_path, variant_id))
+            continue
+
+        # in a force_publish, just load all variants for generation/processing
+        if force_publish:
+            logger.info("Generating new var file for publication_version {}...".format(variant_id))
+        # otherwise, check which ones need to be updated and load only those
+        else:
+            try:
+                target_mtime = os.path.getmtime(target_file_path)
+                source_mtime = cached_source_stat(source_file_path).st_mtime
+            except OSError:
+                # If there is an error, the web XML file likely doesn't exist or is otherwise corrupt
+                # It is then easiest to just generate a new one
+                logger.warning("Error getting time_modified for target or source files for publication_version {}".format(variant_id))
+                logger.info("Generating new file...")
+            else:
+                if target_mtime >= source_mtime:
+                    # If no changes, don't generate CTeiDocument and don't make a new web XML file
+                    continue
+                logger.info("File {} is older than source file {}, generating new file...".format(target_file_path, source_file_path))
+
+        variant_sources.append(source_file_path)
+        variant_paths.append(target_file_path)
+
+    # If no variants have changed and the main variant file is newer than its source, the files are up to date
+    if not force_publish and len(variant_sources) <= 0:
+        try:
+            if os.path.getmtime(main_variant_target) >= cached_source_stat(main_variant_source).st_mtime:
+                return []
+        except OSError:
+            # the main variant file likely doesn't exist yet, so it's generated below
+            pass
+
+    # If any variants have changed, we need a CTeiDocument for the main variant to ProcessVariants() with
+    main_variant_doc, *variant_docs = load_documents([main_variant_source] + variant_sources)
+
+    # lastly, actually process all generated CTeiDocument objects and create web XML files
+    # only variant files whose contents actually changed are returned
+    return process_var_documents_and_generate_files(main_variant_doc, main_variant_target, variant_docs, variant_paths, publication_info)
+
+
+def publish_variant_files_job(job):
+    """
+    Runs publish_variant_files() given a tuple of (publication_info, file_root, force_publish, variants)
+    The variants are passed along, so no database connection is needed, and this can be run in a publishing worker process
+    """
+    publication_info, file_root, force_publish, variants = job
+    return publish_variant_files(publication_info, file_root, force_publish, variants=variants)
+
+
+# database connections of a publishing worker process, keyed by engine and kept open for all publications the worker generates
+worker_connections = dict()
+
+
+def init_publishing_worker():
+    """
+    Initializer for publishing worker processes.
+    Database connections inherited from the parent process mustn't be shared, so the worker drops them from its pools and opens its own.
+    """
+    db_engine.dispose(close=False)
+    for engine in comment_db_engines.values():
+        engine.dispose(close=False)
+    worker_connections.clear()
+
+
+def get_worker_connection(engine):
+    """
+    Returns the connection this worker process uses for the given engine, opening it the first time it's needed.
+    """
+    connection = worker_connections.get(engine)
+    if connection is None:
+        connection = engine.connect()
+        worker_connections[engine] = connection
+    return connection
+
+
+def get_worker_connections(project):
+    """
+    Returns a tuple of the publishing worker's (comment_connection, connection) for the project, connecting the first time they're needed
+    """
+    return get_worker_connection(get_comment_db_engine(project)), get_worker_connection(db_engine)
+
+
+def publish_est_and_com_file_group_in_worker(job_group):
+    """
+    Runs publish_est_and_com_file_group() in a publishing worker process, reusing the worker's database connections between publications
+    """
+    return publish_est_and_com_file_group(job_group, get_worker_connections)
+
+
+def get_chunksize(job_count, workers):
+    """
+    Returns the chunksize used when mapping job_count jobs over a pool of workers.
+    Jobs are sent in chunks of up to 8 to cut down on inter-process overhead, but smaller chunks are used for short job lists,
+    so the jobs are still spread over all workers instead of a few workers getting all of them.
+    """
+    return max(1, min(8, job_count // (workers * 4)))
+
+
+def check_publication_mtimes_and_publish_files(project: str, publication_ids: Union[tuple, None], git_author: str, no_git=False, force_publish=False, is_multilingual=False, jobs=1):
     update_success, result_str = update_files_in_git_repo(project)
     if not update_success:
         logger.error("Git update failed! Reason: {}".format(result_str))
         return False
+    # the update may have changed the source files, so forget what was seen during earlier runs
+    source_stat_cache.clear()
+    source_checksum_cache.clear()
+    target_folder_cache.clear()
     project_id = get_project_id_from_name(project)
     project_settings = config.get(project, None)
 
@@ -310,407 +909,299 @@ def check_publication_mtimes_and_publish_files(project: str, publication_ids: Un
                                 FROM publication_manuscript pm \
                                 JOIN publication p ON pm.publication_id = p.id \
                                 JOIN publication_collection pcol ON p.publication_collection_id = pcol.id \
-                                WHERE pcol.project_id = :proj AND p.deleted != 1 AND pcol.deleted != 1 AND pm.deleted != 1 "
+                                WHERE pcol.project_id = :proj AND p.deleted != 1 AND pcol.deleted != 1 AND pm.deleted != 1 \
+                                AND pm.original_filename IS NOT NULL "
 
             if force_publish and isinstance(publication_ids, tuple):
                 # append publication.id checks if this is a forced (re)publication of certain publication(s)
+                # the IDs are an expanding parameter, like in the module level statements, rather than relying on the driver to adapt a tuple
+                p_ids = bindparam("p_ids", value=list(publication_ids), expanding=True)
                 publication_query += " AND p.id IN :p_ids"
-                publication_query = text(publication_query).bindparams(proj=project_id, p_ids=publication_ids)
+                publication_query = text(publication_query).bindparams(p_ids, proj=project_id)
 
                 comment_query += " AND p.id IN :p_ids"
-                comment_query = text(comment_query).bindparams(proj=project_id, p_ids=publication_ids)
+                comment_query = text(comment_query).bindparams(p_ids, proj=project_id)
 
                 manuscript_query += " AND p.id IN :p_ids"
-                manuscript_query = text(manuscript_query).bindparams(proj=project_id, p_ids=publication_ids)
+                manuscript_query = text(manuscript_query).bindparams(p_ids, proj=project_id)
             else:
                 publication_query = text(publication_query).bindparams(proj=project_id)
                 comment_query = text(comment_query).bindparams(proj=project_id)
                 manuscript_query = text(manuscript_query).bindparams(proj=project_id)
 
-            publication_info = connection.execute(publication_query).fetchall()
-            manuscript_info = connection.execute(manuscript_query).fetchall()
-
             # comment_filenames can just be a dict of publication.id to publication_comment.original_filename
             comment_filenames = dict()
             for row in connection.execute(comment_query):
                 comment_filenames[row.p_id] = row.original_filename
 
-            # close DB connection for now, it won't be needed for a while
-            connection.close()
+            # keep the DB connection for the rest of the run, it's reused for letter info and variant data
+            # but end the transaction, so the connection isn't left idle in a transaction meanwhile
+            connection.rollback()
+
+            # publication and manuscript rows are streamed in batches while they're checked, instead of all being loaded into memory first
+            # rows are used as mappings, so they can be kept (and sent to worker processes) as-is without copying them into dicts
+            publication_query = publication_query.execution_options(yield_per=DATABASE_FETCH_BATCH_SIZE)
+            manuscript_query = manuscript_query.execution_options(yield_per=DATABASE_FETCH_BATCH_SIZE)
 
             # Keep a list of changed files for later git commit
             changes = set()
-            # For each publication belonging to this project, check the modification timestamp of its master files and compare them to the generated web XML files
-            for row in publication_info:
-                if row is None:
-                    continue
-                row = row._asdict()
-                publication_id = row["p_id"]
-                collection_id = row["c_id"]
-                if not row["original_filename"]:
-                    logger.info("Source file not set for publication {}".format(publication_id))
-                    continue
-                est_target_filename = "{}_{}_est.xml".format(collection_id, publication_id)
-                com_target_filename = est_target_filename.replace("_est.xml", "_com.xml")
-
-                if is_multilingual:
-                    language = row["language"]
-                    est_target_filename = "{}_{}_{}_est.xml".format(collection_id, publication_id, language)
-
-                est_target_file_path = os.path.join(file_root, "xml", "est", est_target_filename)
-                com_target_file_path = os.path.join(file_root, "xml", "com", com_target_filename)
-                # original_filename should be relative to the project root
-                est_source_file_path = os.path.join(file_root, row["original_filename"])
+            # checksums of the source files each est and ms file was last generated from, used to skip regenerating files whose sources were only touched
+            state_path = get_publisher_state_path(file_root)
+            publisher_state = load_publisher_state(state_path)
+            if publisher_state.get("checksum_algorithm") != CHECKSUM_ALGORITHM:
+                # checksums saved with another algorithm can't be compared to new ones
+                publisher_state["checksum_algorithm"] = CHECKSUM_ALGORITHM
+                publisher_state["est_fingerprints"] = dict()
+                publisher_state["ms_fingerprints"] = dict()
+                publisher_state["source_checksums"] = dict()
+            est_fingerprints = publisher_state.setdefault("est_fingerprints", dict())
+            ms_fingerprints = publisher_state.setdefault("ms_fingerprints", dict())
+            stored_source_checksums.clear()
+            stored_source_checksums.update(publisher_state.setdefault("source_checksums", dict()))
+            publisher_state["source_checksums"] = stored_source_checksums
+            com_xsl_path = os.path.join(file_root, COMMENTS_XSL_PATH_IN_FILE_ROOT)
+            # folders for the generated web XML files, joined once instead of for every file
+            est_target_folder = os.path.join(file_root, "xml", "est")
+            com_target_folder = os.path.join(file_root, "xml", "com")
+            ms_target_folder = os.path.join(file_root, "xml", "ms")
+            # the connection to the comments database is opened the first time a publication generated in this process needs it
+            comment_connection = None
+
+            def get_connections(project_name):
+                nonlocal comment_connection
+                if comment_connection is None:
+                    comment_connection = get_comment_db_engine(project_name).connect()
+                return comment_connection, connection
+
+            # compile the comments stylesheet once for the whole run, before any worker processes are started,
+            # so the workers get the compiled stylesheet from this process instead of each compiling their own
+            if source_exists(com_xsl_path):
+                try:
+                    CTeiDocument.GetXslt(com_xsl_path)
+                except Exception:
+                    logger.exception("Failed to compile comments stylesheet {}".format(com_xsl_path))
+            # with more than one job, files are generated in a pool of worker processes
+            executor = None
+            if jobs > 1:
+                executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_publishing_worker)
+            try:
+                # For each publication belonging to this project, check the modification timestamp of its master files and compare them to the generated web XML files
+                # publications with unchanged sources get None instead of a job, their variants are still checked
+                est_and_com_jobs = []
+                for row in connection.execute(publication_query).mappings():
+                    if row is None:
+                        continue
+                    publication_id = row["p_id"]
+                    collection_id = row["c_id"]
+                    if not row["original_filename"]:
+                        logger.info("Source file not set for publication {}".format(publication_id))
+                        continue
+                    # each target filename is built once, the com file isn't derived from the est filename
+                    if is_multilingual:
+                        language = row["language"]
+                        est_target_filename = "{}_{}_{}_est.xml".format(collection_id, publication_id, language)
+                    else:
+                        est_target_filename = "{}_{}_est.xml".format(collection_id, publication_id)
+                    com_target_filename = "{}_{}_com.xml".format(collection_id, publication_id)
 
-                # default to template comment file if no entry in publication_comment pointing to a comments file for this publication
-                comment_file = comment_filenames.get(publication_id, COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT)
+                    est_target_file_path = os.path.join(est_target_folder, est_target_filename)
+                    com_target_file_path = os.path.join(com_target_folder, com_target_filename)
+                    # original_filename should be relative to the project root
+                    est_source_file_path = os.path.join(file_root, row["original_filename"])
 
-                if comment_file is None:
-                    logger.info("Comment file not set for publication {}, using template instead.".format(publication_id))
-                    comment_file = COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT
+                    # default to template comment file if no entry in publication_comment pointing to a comments file for this publication
+                    comment_file = comment_filenames.get(publication_id, COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT)
 
-                com_source_file_path = os.path.join(file_root, comment_file)
+                    if comment_file is None:
+                        logger.info("Comment file not set for publication {}, using template instead.".format(publication_id))
+                        comment_file = COMMENTS_TEMPLATE_PATH_IN_FILE_ROOT
 
-                if os.path.isdir(est_source_file_path):
-                    logger.warning("Source file {} for publication {} is a directory!".format(est_source_file_path, publication_id))
-                    continue
-                if os.path.isdir(com_source_file_path):
-                    logger.warning("Source file {} for publication {} comment is a directory!".format(com_source_file_path, publication_id))
-                    continue
-                if not os.path.exists(est_source_file_path):
-                    logger.warning("Source file {} for publication {} does not exist!".format(est_source_file_path, publication_id))
-                    continue
-                if not os.path.exists(com_source_file_path):
-                    logger.warning("Source file {} for publication {} does not exist!".format(com_source_file_path, publication_id))
-                    continue
+                    com_source_file_path = os.path.join(file_root, comment_file)
 
-                if force_publish:
-                    # during force_publish, just generate
-                    logger.info("Generating new est/com files for publication {}...".format(publication_id))
-                    try:
-                        # calculate md5sum for existing files
-                        md5sums = []
-                        if os.path.exists(est_target_file_path):
-                            md5sums.append(calculate_checksum(est_target_file_path))
-                        else:
-                            md5sums.append("SKIP")
-                        if os.path.exists(com_target_file_path):
-                            md5sums.append(calculate_checksum(com_target_file_path))
-                        else:
-                            md5sums.append("SKIP")
-                        generate_est_and_com_files(row, project, est_source_file_path, com_source_file_path,
-                                                   est_target_file_path, com_target_file_path)
-                    except Exception:
-                        logger.exception("Failed to generate est/com files for publication {}!".format(publication_id))
+                    if source_is_dir(est_source_file_path):
+                        logger.warning("Source file {} for publication {} is a directory!".format(est_source_file_path, publication_id))
                         continue
-                    else:
-                        # only add files to change set if they actually changed
-                        if md5sums[0] == "SKIP" or md5sums[0] != calculate_checksum(est_target_file_path):
-                            changes.add(est_target_file_path)
-                        if md5sums[1] == "SKIP" or md5sums[1] != calculate_checksum(com_target_file_path):
-                            changes.add(com_target_file_path)
-                else:
-                    # otherwise, check if this publication's files need to be re-generated
-                    try:
-                        est_target_mtime = os.path.getmtime(est_target_file_path)
-                        com_target_mtime = os.path.getmtime(com_target_file_path)
-                        est_source_mtime = os.path.getmtime(est_source_file_path)
-                        com_source_mtime = os.path.getmtime(com_source_file_path)
-                    except OSError:
-                        # If there is an error, the web XML files likely don't exist or are otherwise corrupt
-                        # It is then easiest to just generate new ones
-                        logger.warning("Error getting time_modified for target or source files for publication {}".format(publication_id))
+                    if source_is_dir(com_source_file_path):
+                        logger.warning("Source file {} for publication {} comment is a directory!".format(com_source_file_path, publication_id))
+                        continue
+                    if not source_exists(est_source_file_path):
+                        logger.warning("Source file {} for publication {} does not exist!".format(est_source_file_path, publication_id))
+                        continue
+                    if not source_exists(com_source_file_path):
+                        logger.warning("Source file {} for publication {} does not exist!".format(com_source_file_path, publication_id))
+                        continue
+
+                    if force_publish:
+                        # during force_publish, just generate
                         logger.info("Generating new est/com files for publication {}...".format(publication_id))
-                        try:
-                            # calculate md5sum for existing files
-                            md5sums = []
-                            if os.path.exists(est_target_file_path):
-                                md5sums.append(calculate_checksum(est_target_file_path))
-                            else:
-                                md5sums.append("SKIP")
-                            if os.path.exists(com_target_file_path):
-                                md5sums.append(calculate_checksum(com_target_file_path))
-                            else:
-                                md5sums.append("SKIP")
-                            generate_est_and_com_files(row, project, est_source_file_path, com_source_file_path,
-                                                       est_target_file_path, com_target_file_path)
-                        except Exception:
-                            logger.exception("Failed to generate est/com files for publication {}!".format(publication_id))
-                            continue
-                        else:
-                            # only add files to change set if they actually changed
-                            if md5sums[0] == "SKIP" or md5sums[0] != calculate_checksum(est_target_file_path):
-                                changes.add(est_target_file_path)
-                            if md5sums[1] == "SKIP" or md5sums[1] != calculate_checksum(com_target_file_path):
-                                changes.add(com_target_file_path)
                     else:
-                        if est_target_mtime >= est_source_mtime and com_target_mtime >= com_source_mtime:
-                            # If both the est and com files are newer than the source files, just continue to the next publication
-                            continue
+                        # otherwise, check if this publication's files need to be re-generated
+                        try:
+                            est_target_mtime = get_target_mtime(est_target_file_path)
+                            com_target_mtime = get_target_mtime(com_target_file_path)
+                            est_source_mtime = cached_source_stat(est_source_file_path).st_mtime
+                            com_source_mtime = cached_source_stat(com_source_file_path).st_mtime
+                        except OSError:
+                            # If there is an error, the web XML files likely don't exist or are otherwise corrupt
+                            # It is then easiest to just generate new ones
+                            logger.warning("Error getting time_modified for target or source files for publication {}".format(publication_id))
+                            logger.info("Generating new est/com files for publication {}...".format(publication_id))
                         else:
-                            # If one or either is outdated, generate new ones
-                            logger.info("Reading files for publication {} are outdated, generating new est/com files...".format(publication_id))
-                            try:
-                                # calculate md5sum for existing files
-                                md5sums = []
-                                if os.path.exists(est_target_file_path):
-                                    md5sums.append(calculate_checksum(est_target_file_path))
-                                else:
-                                    md5sums.append("SKIP")
-                                if os.path.exists(com_target_file_path):
-                                    md5sums.append(calculate_checksum(com_target_file_path))
-                                else:
-                                    md5sums.append("SKIP")
-                                generate_est_and_com_files(row, project, est_source_file_path, com_source_file_path,
-                                                           est_target_file_path, com_target_file_path)
-                            except Exception:
-                                logger.exception("Failed to generate est/com files for publication {}!".format(publication_id))
+                            if est_target_mtime >= est_source_mtime and com_target_mtime >= com_source_mtime:
+                                # If both the est and com files are newer than the source files, just continue to the next publication
                                 continue
-                            else:
-                                # only add files to change set if they actually changed
-                                if md5sums[0] == "SKIP" or md5sums[0] != calculate_checksum(est_target_file_path):
-                                    changes.add(est_target_file_path)
-                                if md5sums[1] == "SKIP" or md5sums[1] != calculate_checksum(com_target_file_path):
-                                    changes.add(com_target_file_path)
-
-                # Process all variants belonging to this publication
-                # publication_version with type=1 is the "main" variant, the others should have type=2 and be versions of that main variant
-                variant_query = text("SELECT id, original_filename "
-                                     "FROM publication_version "
-                                     "WHERE publication_version.publication_id = :pub_id AND publication_version.type = :vers_type AND publication_version.deleted != 1")
-
-                # open new DB connection for variant data fetch
-                connection = db_engine.connect()
-
-                # fetch info for "main" variant
-                main_variant_query = variant_query.bindparams(pub_id=publication_id, vers_type=1)
-                # should only be one main variant per publication?
-                main_variant_info = connection.execute(main_variant_query).fetchone()
-                if main_variant_info is None:
-                    logger.warning("No main variant found for publication {}!".format(publication_id))
-                else:
-                    main_variant_info = main_variant_info._asdict()
-                    logger.debug(f"Main variant query result: {str(main_variant_info)}")
+                            if est_and_com_sources_unchanged(row, est_source_file_path, com_source_file_path, com_xsl_path,
+                                                             est_target_file_path, com_target_file_path, est_fingerprints):
+                                # sources were only touched, the existing files are kept but still checked for changed references
+                                est_and_com_jobs.append((row, None))
+                                continue
+                            # otherwise, generate new ones
+                            logger.info("Reading files for publication {} are outdated, generating new est/com files...".format(publication_id))
 
-                    # fetch info for all "other" variants
-                    variants_query = variant_query.bindparams(pub_id=publication_id, vers_type=2)
-                    variants_info = connection.execute(variants_query).fetchall()
+                    est_and_com_jobs.append((row, (row, project, est_source_file_path, com_source_file_path,
+                                                   est_target_file_path, com_target_file_path)))
 
-                    # close DB connection, as it's no longer needed
-                    connection.close()
+                # For each publication_manuscript belonging to this project, check the modification timestamp of its master file and compare it to the generated web XML file
+                ms_jobs = []
+                # manuscripts without an original_filename are skipped by the query itself, so their rows aren't fetched at all
+                for row in connection.execute(manuscript_query).mappings():
+                    collection_id = row["c_id"]
+                    publication_id = row["p_id"]
+                    manuscript_id = row["m_id"]
 
-                    # compile info and generate files if needed
-                    if main_variant_info["original_filename"] is None:
+                    source_filename = row["original_filename"]
+                    if not source_filename:
+                        logger.info("Source file not set for manuscript {}".format(manuscript_id))
                         continue
 
-                    main_variant_source = os.path.join(file_root, main_variant_info["original_filename"])
-
-                    if not main_variant_source:
-                        logger.warning("Source file for main variant {} is not set.".format(main_variant_info["id"]))
-                        continue
+                    # the target filename is only built for manuscripts that have a source file
+                    target_filename = "{}_{}_ms_{}.xml".format(collection_id,
+                                                               publication_id,
+                                                               manuscript_id)
+                    target_file_path = os.path.join(ms_target_folder, target_filename)
+                    # original_filename should be relative to the project root
+                    source_file_path = os.path.join(file_root, source_filename)
 
-                    if os.path.isdir(main_variant_source):
-                        logger.error("Source file {} for main variant {} (type=1) is a directory!".format(main_variant_source, main_variant_info["id"]))
+                    if source_is_dir(source_file_path):
+                        logger.warning("Source file {} for manuscript {} is a directory!".format(source_file_path, manuscript_id))
                         continue
 
-                    if not os.path.exists(main_variant_source):
-                        logger.error("Source file {} for main variant {} (type=1) does not exist!".format(main_variant_source, main_variant_info["id"]))
+                    if not source_exists(source_file_path):
+                        logger.warning("Source file {} for manuscript {} does not exist!".format(source_file_path, manuscript_id))
                         continue
 
-                    target_filename = "{}_{}_var_{}.xml".format(collection_id,
-                                                                publication_id,
-                                                                main_variant_info["id"])
-
-                    # If any variants have changed, we need a CTeiDocument for the main variant to ProcessVariants() with
-                    main_variant_target = os.path.join(file_root, "xml", "var", target_filename)
-                    # check current md5sum for main variant file
-                    if os.path.exists(main_variant_target):
-                        main_variant_md5 = calculate_checksum(main_variant_target)
+                    # the target file is stat'ed at most once, the result is passed on for comparing the old and new contents
+                    target_stat = None
+                    # in a force_publish, just generate all ms files
+                    if force_publish:
+                        logger.info("Generating new ms file for publication_manuscript {}".format(manuscript_id))
+                    # otherwise, check if this file needs generating
                     else:
-                        main_variant_md5 = "SKIP"
-                    main_variant_doc = CTeiDocument()
-                    main_variant_doc.Load(main_variant_source)
-
-                    # For each "other" variant, create a new CTeiDocument if needed, but if main_variant_updated is True, just make a new for all
-                    variant_docs = []
-                    variant_paths = []
-                    for variant in variants_info:
-                        if variant is None:
-                            continue
-                        variant = variant._asdict()
-                        target_filename = "{}_{}_var_{}.xml".format(collection_id,
-                                                                    publication_id,
-                                                                    variant["id"])
-                        if variant["original_filename"] is None:
-                            continue
-
-                        source_filename = variant["original_filename"]
-                        if not source_filename:
-                            logger.error("Source file for variant {} is not set.".format(variant["id"]))
-                            continue
-                        target_file_path = os.path.join(file_root, "xml", "var", target_filename)
-                        # original_filename should be relative to the project root
-                        source_file_path = os.path.join(file_root, source_filename)
-
-                        if os.path.isdir(source_file_path):
-                            logger.error("Source file {} for variant {} is a directory!".format(source_file_path, variant["id"]))
-                            continue
-                        if not os.path.exists(source_file_path):
-                            logger.error("Source file {} for variant {} does not exist!".format(source_file_path, variant["id"]))
-                            continue
-
-                        # in a force_publish, just load all variants for generation/processing
-                        if force_publish:
-                            logger.info("Generating new var file for publication_version {}...".format(variant["id"]))
-                            variant_doc = CTeiDocument()
-                            variant_doc.Load(source_file_path)
-                            variant_docs.append(variant_doc)
-                            variant_paths.append(target_file_path)
-                        # otherwise, check which ones need to be updated and load only those
-                        else:
-                            try:
-                                target_mtime = os.path.getmtime(target_file_path)
-                                source_mtime = os.path.getmtime(source_file_path)
-                            except OSError:
-                                # If there is an error, the web XML file likely doesn't exist or is otherwise corrupt
-                                # It is then easiest to just generate a new one
-                                logger.warning("Error getting time_modified for target or source files for publication_version {}".format(variant["id"]))
-                                logger.info("Generating new file...")
-                                variant_doc = CTeiDocument()
-                                variant_doc.Load(source_file_path)
-                                variant_docs.append(variant_doc)
-                                variant_paths.append(target_file_path)
-                            else:
-                                if target_mtime < source_mtime:
-                                    logger.info("File {} is older than source file {}, generating new file...".format(target_file_path, source_file_path))
-                                    variant_doc = CTeiDocument()
-                                    variant_doc.Load(source_file_path)
-                                    variant_docs.append(variant_doc)
-                                    variant_paths.append(target_file_path)
-                                else:
-                                    # If no changes, don't generate CTeiDocument and don't make a new web XML file
-                                    continue
-                    # check current md5sum for variant files
-                    variant_md5_sums = {}
-                    for path in variant_paths:
-                        if not os.path.exists(path):
-                            variant_md5_sums[path] = "SKIP"
+                        try:
+                            target_stat = get_target_stat(target_file_path)
+                            target_mtime = target_stat.st_mtime
+                            source_mtime = cached_source_stat(source_file_path).st_mtime
+                        except OSError:
+                            # If there is an error, the web XML file likely doesn't exist or is otherwise corrupt
+                            # It is then easiest to just generate a new one
+                            logger.warning("Error getting time_modified for target or source file for publication_manuscript {}".format(manuscript_id))
+                            logger.info("Generating new file...")
                         else:
-                            variant_md5_sums[path] = calculate_checksum(path)
-                    # lastly, actually process all generated CTeiDocument objects and create web XML files
-                    process_var_documents_and_generate_files(main_variant_doc, main_variant_target, variant_docs, variant_paths, row)
-
-                    # only add main variant file to change set if file actually changed
-                    if main_variant_md5 == "SKIP" or main_variant_md5 != calculate_checksum(main_variant_target):
-                        changes.add(main_variant_target)
-                    # only add variant files to change set if their file actually changed
-                    for path, md5sum in variant_md5_sums.items():
-                        if md5sum == "SKIP" or md5sum != calculate_checksum(path):
-                            changes.add(path)
-
-            # For each publication_manuscript belonging to this project, check the modification timestamp of its master file and compare it to the generated web XML file
-            for row in manuscript_info:
-                if row is None:
-                    continue
-                row = row._asdict()
-                collection_id = row["c_id"]
-                publication_id = row["p_id"]
-                manuscript_id = row["m_id"]
-                target_filename = "{}_{}_ms_{}.xml".format(collection_id,
-                                                           publication_id,
-                                                           manuscript_id)
-                if row["original_filename"] is None:
-                    continue
-
-                source_filename = row["original_filename"]
-                if not source_filename:
-                    logger.info("Source file not set for manuscript {}".format(manuscript_id))
-                    continue
+                            if target_mtime >= source_mtime:
+                                # If the target ms file is newer than the source, continue to the next publication_manuscript
+                                continue
+                            if ms_source_unchanged(row, source_file_path, target_file_path, ms_fingerprints):
+                                # the source was only touched, the existing file is kept
+                                continue
+                            logger.info("File {} is older than source file {}, generating new file...".format(target_file_path, source_file_path))
 
-                target_file_path = os.path.join(file_root, "xml", "ms", target_filename)
-                # original_filename should be relative to the project root
-                source_file_path = os.path.join(file_root, source_filename)
+                    ms_jobs.append((source_file_path, target_file_path, row, target_stat))
 
-                if os.path.isdir(source_file_path):
-                    logger.warning("Source file {} for manuscript {} is a directory!".format(source_file_path, manuscript_id))
-                    continue
+                # fetch the variants of all these publications at once, instead of querying for each publication separately
+                variants = get_variants_from_database([row["p_id"] for row, job in est_and_com_jobs], connection=connection)
 
-                if not os.path.exists(source_file_path):
-                    logger.warning("Source file {} for manuscript {} does not exist!".format(source_file_path, manuscript_id))
-                    continue
+                # the jobs of each publication are grouped, as the est files of all its languages share one com file
+                # each group is run by a single worker, in the order the jobs were queued
+                job_groups = dict()
+                for index, (row, job) in enumerate(est_and_com_jobs):
+                    if job is not None:
+                        job_groups.setdefault(row["p_id"], []).append((index, job))
+                if executor is not None:
+                    group_results = executor.map(publish_est_and_com_file_group_in_worker, job_groups.values(),
+                                                 chunksize=get_chunksize(len(job_groups), jobs))
+                else:
+                    group_results = (publish_est_and_com_file_group(job_group, get_connections)
+                                     for job_group in job_groups.values())
+                # results by job index, groups are collected in the order of their first job as the results are needed
+                generate_results = dict()
+
+                # with a worker pool, all ms files are queued right after the est/com files, so the workers stay busy
+                # while est/com results are collected here and the variant jobs are queued after them
+                if executor is not None:
+                    ms_results = executor.map(publish_ms_file, ms_jobs, chunksize=get_chunksize(len(ms_jobs), jobs))
+                else:
+                    ms_results = (publish_ms_file(job) for job in ms_jobs)
+
+                # variants are processed once per publication, even if there are est/com files in several languages
+                variant_jobs = dict()
+                for index, (row, job) in enumerate(est_and_com_jobs):
+                    if job is not None:
+                        while index not in generate_results:
+                            generate_results.update(next(group_results))
+                        changed_files = generate_results.pop(index)
+                        # if the est/com files couldn't be generated, the variants of the publication are skipped as well
+                        if changed_files is None:
+                            continue
+                        changes.update(changed_files)
+                        est_source_file_path, com_source_file_path, est_target_file_path = job[2], job[3], job[4]
+                        try:
+                            est_fingerprints[est_target_file_path] = get_est_and_com_fingerprint(row, est_source_file_path, com_source_file_path, com_xsl_path)
+                        except OSError:
+                            est_fingerprints.pop(est_target_file_path, None)
+                    if row["p_id"] not in variant_jobs:
+                        variant_jobs[row["p_id"]] = (row, file_root, force_publish, variants[row["p_id"]])
+
+                # Process all variants belonging to these publications
+                if executor is not None:
+                    variant_results = executor.map(publish_variant_files_job, variant_jobs.values(),
+                                                   chunksize=get_chunksize(len(variant_jobs), jobs))
+                else:
+                    variant_results = (publish_variant_files_job(job) for job in variant_jobs.values())
+                for changed_files in variant_results:
+                    changes.update(changed_files)
 
-                # in a force_publish, just generate all ms files
-                if force_publish:
-                    logger.info("Generating new ms file for publication_manuscript {}".format(manuscript_id))
-                    try:
-                        # calculate md5sum for existing file
-                        if os.path.exists(target_file_path):
-                            md5sum = calculate_checksum(target_file_path)
-                        else:
-                            md5sum = "SKIP"
-                        generate_ms_file(source_file_path, target_file_path, row)
-                    except Exception:
+                for (source_file_path, target_file_path, row, target_stat), changed_files in zip(ms_jobs, ms_results):
+                    if changed_files is None:
+                        ms_fingerprints.pop(target_file_path, None)
                         continue
-                    else:
-                        # only add to changes if file has actually changed
-                        if md5sum == "SKIP" or md5sum != calculate_checksum(target_file_path):
-                            changes.add(target_file_path)
-                # otherwise, check if this file needs generating
-                else:
+                    changes.update(changed_files)
                     try:
-                        target_mtime = os.path.getmtime(target_file_path)
-                        source_mtime = os.path.getmtime(source_file_path)
+                        ms_fingerprints[target_file_path] = get_ms_fingerprint(row, source_file_path)
                     except OSError:
-                        # If there is an error, the web XML file likely doesn't exist or is otherwise corrupt
-                        # It is then easiest to just generate a new one
-                        logger.warning("Error getting time_modified for target or source file for publication_manuscript {}".format(manuscript_id))
-                        logger.info("Generating new file...")
-                        try:
-                            # calculate md5sum for existing file
-                            if os.path.exists(target_file_path):
-                                md5sum = calculate_checksum(target_file_path)
-                            else:
-                                md5sum = "SKIP"
-                            generate_ms_file(source_file_path, target_file_path, row)
-                        except Exception:
-                            continue
-                        else:
-                            # only add to changes if file has actually changed
-                            if md5sum == "SKIP" or md5sum != calculate_checksum(target_file_path):
-                                changes.add(target_file_path)
-                    else:
-                        if target_mtime >= source_mtime:
-                            # If the target ms file is newer than the source, continue to the next publication_manuscript
-                            continue
-                        else:
-                            logger.info("File {} is older than source file {}, generating new file...".format(target_file_path, source_file_path))
-                            try:
-                                # calculate md5sum for existing file
-                                if os.path.exists(target_file_path):
-                                    md5sum = calculate_checksum(target_file_path)
-                                else:
-                                    md5sum = "SKIP"
-                                generate_ms_file(source_file_path, target_file_path, row)
-                            except Exception:
-                                continue
-                            else:
-                                # only add to changes if file has actually changed
-                                if md5sum == "SKIP" or md5sum != calculate_checksum(target_file_path):
-                                    changes.add(target_file_path)
-
-            logger.debug("Changes made in publication script run: {}".format([c for c in changes]))
+                        ms_fingerprints.pop(target_file_path, None)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+                if comment_connection is not None:
+                    comment_connection.close()
+                connection.close()
+                save_publisher_state(state_path, publisher_state)
+
+            logger.debug("Changes made in publication script run: {}".format(list(changes)))
             if len(changes) > 0 and not no_git:
                 outputs = []
                 # If there are changes, try to commit them to git
                 try:
-                    for change in changes:
-                        # Each changed file should be added, as there may be other activity in the git repo we don't want to commit
-                        outputs.append(run_git_command(project, ["add", change]))
+                    # Each changed file should be added, as there may be other activity in the git repo we don't want to commit
+                    # The files are added in batches, instead of running git once for each file
+                    changed_files = sorted(changes)
+                    for i in range(0, len(changed_files), GIT_ADD_BATCH_SIZE):
+                        outputs.append(run_git_command(project, ["add", "--"] + changed_files[i:i + GIT_ADD_BATCH_SIZE]))
                     outputs.append(run_git_command(project, ["commit", "--author", git_author, "-m", "Published new web files"]))
                     outputs.append(run_git_command(project, ["push"]))
                 except CalledProcessError:
                     logger.exception("Exception during git sync of webfile changes.")
-                    logger.debug("Git outputs: {}".format("\n".join(outputs)))
+                    logger.debug("Git outputs: {}".format(b"\n".join(outputs).decode("utf-8", "replace")))
 
 
 if __name__ == "__main__":
@@ -725,9 +1216,16 @@ if __name__ == "__main__":
     parser.add_argument("--git_author", type=str, help="Author used for git commits (Default 'Publisher <is@sls.fi>')", default="Publisher <is@sls.fi>")
     parser.add_argument("--no_git", action="store_true", help="Don't run git commands as part of publishing.")
     parser.add_argument("--is_multilingual", action="store_true", help="The publication is multilingual and original_filename is found in translation_text")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to generate est/com, ms and var files, 0 for one per CPU (Default 1, everything is done in this process)")
 
     args = parser.parse_args()
 
+    if args.jobs < 0:
+        parser.error("--jobs can't be negative, use 0 for one worker process per CPU")
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+
     if args.list_projects:
         logger.info(f"Projects with seemingly valid configuration: {', '.join(valid_projects)}")
         sys.exit(0)
@@ -742,11 +1240,12 @@ if __name__ == "__main__":
         if str(args.project).lower() == "all":
             for p in valid_projects:
                 check_publication_mtimes_and_publish_files(p, ids, git_author=args.git_author,
-                                                           no_git=args.no_git, force_publish=args.all_ids)
+                                                           no_git=args.no_git, force_publish=args.all_ids, jobs=args.jobs)
         else:
             if args.project in valid_projects:
                 check_publication_mtimes_and_publish_files(args.project, ids, git_author=args.git_author,
-                                                           no_git=args.no_git, force_publish=args.all_ids, is_multilingual=args.is_multilingual)
+                                                           no_git=args.no_git, force_publish=args.all_ids, is_multilingual=args.is_multilingual,
+                                                           jobs=args.jobs)
             else:
                 logger.error(f"{args.project} is not in the API configuration or lacks 'comments_database' setting, aborting...")
                 sys.exit(1)
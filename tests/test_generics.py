@@ -0,0 +1,22 @@
+from sls_api.endpoints.generics import transform_xml
+
+
+FRAGMENT_XSL = """<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+<xsl:output method="html" encoding="UTF-8"/>
+<xsl:template match="/"><p id="a" class="first">one <span id="c">id="x"</span></p><p id="b">two</p></xsl:template>
+</xsl:stylesheet>
+"""
+
+
+def test_transform_xml_replaces_ids_in_every_top_level_element(tmp_path):
+    xsl_file_path = tmp_path / "fragment.xsl"
+    xsl_file_path.write_text(FRAGMENT_XSL, encoding="utf-8")
+    xml_file_path = tmp_path / "document.xml"
+    xml_file_path.write_text("<document/>", encoding="utf-8")
+
+    result = transform_xml(str(xsl_file_path), str(xml_file_path), replace_ids=True)
+
+    assert " id=" not in result.replace('id="x"', "")
+    assert '<p data-id="a" class="first">' in result
+    assert '<span data-id="c">id="x"</span>' in result
+    assert '<p data-id="b">two</p>' in result